@@ -0,0 +1,236 @@
+import warnings
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# 📌 Calcoli della dashboard senza Streamlit né pandas: array in ingresso, risultati tipizzati in uscita.
+# Le funzioni sono pure, quindi si possono misurare, mettere in cache ed eseguire in processi separati.
+
+Metric = Tuple[str, str, str]  # (label, column, unit), come in Schema.KEY_METRICS
+
+
+class CardDelta(NamedTuple):
+    """Key metric card: latest value against the baseline mean, NaN baseline and delta when there is none"""
+    label: str
+    column: str
+    unit: str
+    value: float
+    baseline: float
+    delta: float
+
+    @property
+    def compared(self) -> bool:
+        return not np.isnan(self.delta)
+
+
+class RadarAxes(NamedTuple):
+    """Latest sample and baseline on each radar axis, normalized to 0-1 over the history range"""
+    metrics: List[str]
+    latest: np.ndarray
+    baseline: np.ndarray
+
+
+class AnomalyStatus(NamedTuple):
+    """Anomaly check of the latest sample: worst score, its metric and side of the median"""
+    score: float
+    metric: str
+    direction: str
+    flagged: bool
+
+
+def _as_matrix(values) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    return values.reshape(-1, 1) if values.ndim == 1 else values
+
+
+def column_means(values: np.ndarray) -> np.ndarray:
+    """
+    NaN-skipping mean of every column of an (n, k) array, NaN for columns without values
+    """
+    values = _as_matrix(values)
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=0)
+    sums = np.where(valid, values, 0.0).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def mean_previous(values: np.ndarray) -> np.ndarray:
+    """
+    Baseline of a window of samples: column means of every row but the last one (the latest sample)
+    """
+    return column_means(_as_matrix(values)[:-1])
+
+
+def card_deltas(latest: np.ndarray, baseline: Optional[np.ndarray], metrics: Sequence[Metric]) -> List[CardDelta]:
+    """
+    One card per metric, latest and baseline aligned with metrics; baseline None when the latest
+    sample has nothing to be compared with
+    """
+    latest = np.asarray(latest, dtype=np.float64)
+    baseline = np.full(len(latest), np.nan) if baseline is None else np.asarray(baseline, dtype=np.float64)
+    return [CardDelta(label, column, unit, float(value), float(mean), float(value - mean))
+            for (label, column, unit), value, mean in zip(metrics, latest, baseline)]
+
+
+def normalize(values: np.ndarray, minimum: np.ndarray, maximum: np.ndarray) -> np.ndarray:
+    """
+    Scale values to 0-1 over [minimum, maximum], constant columns use a unit range
+    """
+    minimum = np.asarray(minimum, dtype=np.float64)
+    span = np.asarray(maximum, dtype=np.float64) - minimum
+    span = np.where(span == 0, 1.0, span)
+    return (np.asarray(values, dtype=np.float64) - minimum) / span
+
+
+def radar_axes(metrics: List[str], latest: np.ndarray, baseline: np.ndarray, minimum: np.ndarray,
+               maximum: np.ndarray) -> RadarAxes:
+    return RadarAxes(list(metrics), normalize(latest, minimum, maximum), normalize(baseline, minimum, maximum))
+
+
+def sorted_columns(values: np.ndarray) -> List[np.ndarray]:
+    """
+    Sorted values of every column of an (n, k) array without NaN, the input of percentile_ranks
+    """
+    values = _as_matrix(values)
+    return [np.sort(column[~np.isnan(column)]) for column in values.T]
+
+
+def percentile_rank(sorted_values: np.ndarray, value: float) -> float:
+    """
+    Percentage of the samples strictly below value, a binary search on the sorted samples
+    """
+    if not len(sorted_values):
+        return np.nan
+    return np.searchsorted(sorted_values, value, side='left') / len(sorted_values) * 100
+
+
+def percentile_ranks(columns: Sequence[np.ndarray], latest: np.ndarray) -> np.ndarray:
+    return np.array([percentile_rank(values, value) for values, value in zip(columns, latest)], dtype=np.float64)
+
+
+def covariance_to_correlation(cov: np.ndarray) -> np.ndarray:
+    """
+    Pearson correlation from a covariance matrix, NaN where a column is constant (like pandas)
+    """
+    std = np.sqrt(np.diag(cov))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.clip(cov / np.outer(std, std), -1, 1)
+
+
+def correlation_matrix(values: np.ndarray) -> np.ndarray:
+    """
+    Pearson correlation of the columns of an (n, k) array over pairwise complete rows, the same
+    result as DataFrame.corr() computed with a few matrix products instead of k² passes
+    """
+    values = _as_matrix(values)
+    valid = (~np.isnan(values)).astype(np.float64)
+    # Sums of values centered on the column means: uncentered sums lose precision to cancellation when
+    # the values sit far from zero (an offset of 1e6 cost ~1e-3 against DataFrame.corr())
+    shift = np.nan_to_num(column_means(values))
+    x = np.where(valid > 0, values - shift, 0.0)
+    count = valid.T @ valid
+    sum_x = x.T @ valid  # Somma della colonna i sulle righe dove anche j è valida
+    sum_xx = (x * x).T @ valid
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = x.T @ x - sum_x * sum_x.T / count
+        var_x = sum_xx - sum_x * sum_x / count
+        corr = cov / np.sqrt(var_x * var_x.T)
+    corr[(count < 2) | (var_x <= 0) | (var_x.T <= 0)] = np.nan
+    return np.clip(corr, -1, 1)
+
+
+def anomaly_status(score: float, metric: str, value: float, median: float, threshold: float) -> Optional[AnomalyStatus]:
+    """
+    Verdict for the latest sample's anomaly score, None when it was not scored
+    """
+    if score != score:  # NaN
+        return None
+    return AnomalyStatus(float(score), metric, "above" if value > median else "below", bool(score > threshold))
+
+
+def count_flagged(scores: np.ndarray, threshold: float) -> int:
+    with np.errstate(invalid="ignore"):
+        return int((np.asarray(scores) > threshold).sum())
+
+
+def _stat(func, values) -> float:
+    # NaN invece di un warning quando la colonna non ha valori
+    values = np.asarray(values, dtype=np.float64)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return float(func(values)) if len(values) else np.nan
+
+
+class ColumnSummary(NamedTuple):
+    """Mean, minimum and maximum of each column, e.g. read from RunningStats instead of the raw values"""
+    mean: Dict[str, float]
+    min: Dict[str, float]
+    max: Dict[str, float]
+
+
+Columns = Union[Mapping[str, np.ndarray], ColumnSummary]
+
+
+def column_summary(columns: Columns, names: Sequence[str]) -> ColumnSummary:
+    """
+    Summary of the named columns of a mapping column -> values (a ColumnSummary is returned as is)
+    """
+    if isinstance(columns, ColumnSummary):
+        return columns
+    return ColumnSummary({col: _stat(np.nanmean, columns[col]) for col in names},
+                         {col: _stat(np.nanmin, columns[col]) for col in names},
+                         {col: _stat(np.nanmax, columns[col]) for col in names})
+
+
+def _names(columns: Columns) -> Iterable[str]:
+    return columns.mean.keys() if isinstance(columns, ColumnSummary) else columns
+
+
+def temperature_summary(columns: Columns) -> Dict[str, float]:
+    """
+    Temperature statistics from the thermal camera columns (a mapping column -> values or a ColumnSummary)
+    """
+    required = ['Max Temperature (°C)', 'Min Temperature (°C)', 'Mean Temperature (°C)', '% Pixels Above 40°C']
+    if not all(col in _names(columns) for col in required):
+        return {}
+    summary = column_summary(columns, required)
+    highest = summary.max['Max Temperature (°C)']
+    lowest = summary.min['Min Temperature (°C)']
+    return {
+        'max_temperature': highest,
+        'min_temperature': lowest,
+        'avg_temperature': summary.mean['Mean Temperature (°C)'],
+        'temperature_range': highest - lowest,
+        'above_40_percent': summary.mean['% Pixels Above 40°C'],
+    }
+
+
+def pm_summary(columns: Columns) -> Dict[str, float]:
+    """
+    Mean of every particulate column (PM*) and the highest reading among them
+    """
+    pm_cols = [col for col in _names(columns) if col.startswith('PM')]
+    if not pm_cols:
+        return {}
+    summary = column_summary(columns, pm_cols)
+    result = {col: summary.mean[col] for col in pm_cols}
+    result['max_pm'] = max(summary.max[col] for col in pm_cols)
+    return result
+
+
+def color_summary(columns: Columns) -> Dict[str, float]:
+    """
+    Mean of each RGB channel and the variance between the three means
+    """
+    color_cols = ['Mean_Red', 'Mean_Green', 'Mean_Blue']
+    if not all(col in _names(columns) for col in color_cols):
+        return {}
+    summary = column_summary(columns, color_cols)
+    red, green, blue = (summary.mean[col] for col in color_cols)
+    return {
+        'avg_red': red,
+        'avg_green': green,
+        'avg_blue': blue,
+        'color_variance': float(np.var([red, green, blue])),
+    }
@@ -1,11 +1,34 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 import time
 import pytz
 from datetime import datetime
-from streamlit_autorefresh import st_autorefresh
+import pandas as pd
+import Schema
+from Analytics import (anomaly_status, card_deltas, correlation_matrix, count_flagged, mean_previous,
+                       percentile_ranks, radar_axes, sorted_columns)
+from Charts import (CHART_WIDTH_PX, cached_figure, correlation_heatmap, history_chart, percentile_chart,
+                    radar_chart)
+from Data import (ANOMALY_THRESHOLD, ROLLUPS, DataService, FleetService, TailLoader, has_timestamps, query_window,
+                  window_rows)
+from Export import EXPORT_FORMATS, export_bytes, select_rows
+from Ingest import Ingestor, configured_ingest_port, start_server
+from Metrics import METRICS, configured_exports, start_exporter, start_json_log
+from Sources import LOCAL_CSV, configured_fleet, configured_source
+from Storage import SIDECAR_SUFFIX, ArrowStore
+from utils import color_array, create_color_visualization
+
+SWATCH_PAGE_SIZE = 50  # Campioni per pagina nella colonna Color Swatches
+WATCH_INTERVAL = 1  # Secondi tra due controlli della versione dei dati
+
+# 📌 Finestre di riferimento per il confronto con l'ultimo campione: etichetta -> (ultimi N, ultime K ore)
+BASELINE_WINDOWS = {
+    "All samples": (None, None),
+    "Last 20 samples": (20, None),
+    "Last 100 samples": (100, None),
+    "Last 8 hours": (None, 8),
+    "Last 24 hours": (None, 24),
+    "Last 7 days": (None, 24 * 7),
+}
 
 # Configurazione della pagina: DEVE ESSERE LA PRIMA chiamata Streamlit
 st.set_page_config(
@@ -105,25 +128,8 @@ def inject_css():
 # Map new column names to expected names in the app
 def map_column_names(df):
     """Map the new column names from process_images to the expected column names in the app"""
-    column_mapping = {
-        'mean_H': 'Mean_H',
-        'mean_S': 'Mean_S',
-        'mean_a': 'a*',
-        'mean_b': 'b*',
-        'dom_R': 'Mean_Red',
-        'dom_G': 'Mean_Green',
-        'dom_B': 'Mean_Blue'
-    }
-
-    # Create a copy of the dataframe
-    df_mapped = df.copy()
-
-    # Rename columns based on mapping
-    for new_col, old_col in column_mapping.items():
-        if new_col in df_mapped.columns:
-            df_mapped.rename(columns={new_col: old_col}, inplace=True)
-
-    return df_mapped
+    # Le sorgenti rinominano già in lettura (Schema.DISPLAY_NAMES), qui solo per frame esterni
+    return df.rename(columns=Schema.DISPLAY_NAMES)
 
 
 if __name__ == "__main__":
@@ -131,26 +137,82 @@ if __name__ == "__main__":
     inject_css()  # Now using only one CSS injection function
 
 
+    # Prepara le nuove righe appena lette dal loader incrementale
+    def prepare_rows(new_rows):
+        # Aggiunge una colonna "Sample ID" per il tracciamento (nomi e tipi arrivano già dallo schema)
+        new_rows['Sample ID'] = new_rows.index + 1
+        return new_rows
+
+
+    # Un solo servizio dati per processo, condiviso da tutte le sessioni aperte
+    @st.cache_resource
+    def get_data_service(source):
+        return DataService(TailLoader(source, transform=prepare_rows)).start()
+
+
+    # Fleet mode: tutte le macchine in un solo servizio, con un pool di thread condiviso
+    @st.cache_resource
+    def get_fleet_service(machines):
+        return FleetService({machine: TailLoader(spec, transform=prepare_rows) for machine, spec in machines}).start()
+
+
+    fleet = configured_fleet()
+
+
+    # API di ingestione nello stesso processo: i batch ricevuti svegliano subito il servizio dati
+    @st.cache_resource
+    def get_ingest_server(store, port):
+        ingestor = Ingestor(ArrowStore(store))
+        ingestor.subscribe(get_data_service(store).wake)
+        return start_server(ingestor, port=port)
+
+
+    # Esportazione delle metriche per un collector locale (Prometheus o log JSON), una per processo
+    @st.cache_resource
+    def get_metrics_exports(port, log):
+        return (start_exporter(port) if port else None), (start_json_log(log) if log else None)
+
+
+    metrics_port, metrics_log = configured_exports()
+    if metrics_port or metrics_log:
+        get_metrics_exports(metrics_port, metrics_log)
+
+    ingest_port = configured_ingest_port()
+    if ingest_port and not fleet:
+        if configured_source().rstrip("/").endswith(SIDECAR_SUFFIX):
+            get_ingest_server(configured_source(), ingest_port)
+        else:
+            st.warning("Ingestion needs an Arrow store as source, e.g. --source samples.arrow")
+
+
+    def current_service():
+        if fleet:
+            return get_fleet_service(tuple(fleet.items())).services[st.session_state.machine]
+        return get_data_service(configured_source())
+
+
+    def data_fingerprint():
+        # In fleet mode anche le altre macchine compaiono nella panoramica
+        if fleet:
+            return tuple(s.snapshot.fingerprint for s in get_fleet_service(tuple(fleet.items())).services.values())
+        return current_service().snapshot.fingerprint
+
+
     # Funzione per il caricamento dei dati
-    @st.cache_data(ttl=30)  # Cache dei dati per 30 secondi
-    def load_data():
-        # At the start of your load_data function
-        st.cache_data.clear()  # Force clear the entire cache
-        timestamp = int(time.time())
-        try:
-            csv_url = f"https://raw.githubusercontent.com/FabioDani2295/CoffeeController/main/CoffeStatistics.csv?{timestamp}"
-            df = pd.read_csv(csv_url)
-            # Aggiunge una colonna "Sample ID" per il tracciamento
-            df['Sample ID'] = range(1, len(df) + 1)
-            # Map new column names to old ones
-            df = map_column_names(df)
-            return df
-        except Exception as e:
-            st.error(f"Error loading data: {e}")
+    def load_data(report_errors=True):
+        # Sorgente configurabile: streamlit run App.py -- --source SPEC oppure COFFEE_SOURCE
+        service = current_service()
+        snapshot = service.get()
+        # Versione dei dati mostrata da questa sessione, confrontata dal watcher
+        st.session_state.data_fingerprint = data_fingerprint()
+        if service.error is not None:
+            if report_errors:
+                retry_in = max(0, int(service.retry_at - time.monotonic()))
+                st.error(f"Error loading data: {service.error} (attempt {service.failures}, retrying in {retry_in}s)")
             # Restituisce dati di esempio se il caricamento fallisce
-            df = pd.read_csv("CoffeStatistics.csv") if st.session_state.get("demo_mode", False) else pd.DataFrame()
-            df = map_column_names(df)
-            return df
+            if st.session_state.get("demo_mode", False):
+                return get_data_service(LOCAL_CSV).get()
+        return snapshot
 
 
     # Inizializzazione dello stato di sessione per le selezioni
@@ -162,31 +224,36 @@ if __name__ == "__main__":
             'particles': ['particles_beyond_0_3', 'particles_beyond_1_0']
         }
 
-    if 'refresh_rate' not in st.session_state:
-        st.session_state.refresh_rate = 30
+    if 'live_updates' not in st.session_state:
+        st.session_state.live_updates = True
 
     if 'demo_mode' not in st.session_state:
         st.session_state.demo_mode = False
 
-    # Auto-refresh basato sullo stato di sessione
-    refresh_count = st_autorefresh(interval=st.session_state.refresh_rate * 1000, key="data_refresh")
+    if 'diagnostics' not in st.session_state:
+        st.session_state.diagnostics = False
+
+    if fleet:
+        if st.session_state.get('machine') not in fleet:
+            st.session_state.machine = next(iter(fleet))
+        with st.sidebar:
+            st.markdown("### 🏭 Fleet")
+            st.selectbox("Machine", list(fleet), key="machine")
 
-    # Caricamento dei dati
-    df = load_data()
+    # La sidebar legge solo le colonne disponibili
+    df = load_data(report_errors=False).df
 
     # SIDEBAR - Design più compatto
     with st.sidebar:
         st.markdown("### ⚙️ Dashboard Controls")
 
-        # Controllo del refresh rate
-        st.slider(
-            "Refresh Rate (sec)",
-            min_value=5,
-            max_value=120,
-            value=st.session_state.refresh_rate,
-            step=5,
-            key="refresh_rate_input",
-            on_change=lambda: setattr(st.session_state, 'refresh_rate', st.session_state.refresh_rate_input)
+        # Aggiornamento automatico quando arrivano nuovi campioni
+        st.toggle(
+            "Live Updates",
+            value=st.session_state.live_updates,
+            key="live_updates_input",
+            on_change=lambda: setattr(st.session_state, 'live_updates', st.session_state.live_updates_input),
+            help="Refresh the dashboard as soon as new samples arrive"
         )
 
         # Toggle per Demo Mode
@@ -198,14 +265,17 @@ if __name__ == "__main__":
             help="Use local data if online source unavailable"
         )
 
-        # Organizzazione delle colonne per categoria, aggiornata
-        column_categories = {
-            "Temperature": [col for col in df.columns if "Temperature" in col],
-            "Particulate Matter": [col for col in df.columns if "PM" in col],
-            "Particles": [col for col in df.columns if "particles_beyond" in col],
-            "Color": ['Mean_Red', 'Mean_Green', 'Mean_Blue', 'Mean_H', 'Mean_S', 'a*', 'b*', 'Dist_White', 'Dist_Gray'],
-            "Weight": ['Min Weight', 'Max Weight', 'Weight Range', 'Average Weight']
-        }
+        # Tempi di caricamento, sezioni e grafici dell'ultimo rendering
+        st.checkbox("Diagnostics", key="diagnostics", help="Show per-stage timings, counters and memory")
+
+        # Finestra di riferimento: le finestre temporali richiedono i timestamp dei campioni
+        baseline_options = [label for label, (_, hours) in BASELINE_WINDOWS.items()
+                            if hours is None or has_timestamps(df)]
+        st.selectbox("Baseline", baseline_options, key="baseline",
+                     help="Samples the latest shot is compared with (cards, radar, correlations, ranks)")
+
+        # Organizzazione delle colonne per categoria, dal registro dello schema
+        column_categories = Schema.COLUMN_CATEGORIES
 
         # Selezione delle metriche nella sidebar
         st.markdown("### 📊 Metrics")
@@ -231,47 +301,93 @@ if __name__ == "__main__":
     # DASHBOARD PRINCIPALE
     st.markdown('<div class="main-header">☕ Coffee machine analysis</div>', unsafe_allow_html=True)
 
-    # CONFRONTO ULTIMO CAMPIONE DI COFFEE
-    if not df.empty:
-        # Recupera l'ultimo campione (ultima riga) e i campioni precedenti
-        latest_sample = df.iloc[-1]
-
-        st.markdown('<div class="section-header">Latest coffee overview</div>', unsafe_allow_html=True)
-
-        # Visualizzazione del Sample ID
-        st.markdown(
-            '<h4 style="color: white; background-color: #333; padding: 5px; border-radius: 5px;">Sample #{}</h4>'.format(
-                len(df)), unsafe_allow_html=True)
-
-        # Updated key metrics to match radar chart metrics
-        key_metrics = [
-            ("Max Temp", "Max Temperature (°C)", "°C"),
-            ("PM1.0", "PM1_0_CU", ""),
-            ("PM2.5", "PM2_5_CU", ""),
-            ("Avg Weight", "Average Weight", "g")
-        ]
-
-        # Add color metrics (check both uppercase and lowercase versions)
-        if "Mean_H" in df.columns:
-            key_metrics.append(("Hue", "Mean_H", ""))
-        elif "mean_H" in df.columns:
-            key_metrics.append(("Hue", "mean_H", ""))
+    def show_chart(panel, fig):
+        # Serializzazione e invio della figura al frontend, misurati per pannello
+        with METRICS.span("chart_send", panel=panel):
+            st.plotly_chart(fig, use_container_width=True)
 
-        if "Mean_S" in df.columns:
-            key_metrics.append(("Saturation", "Mean_S", ""))
-        elif "mean_S" in df.columns:
-            key_metrics.append(("Saturation", "mean_S", ""))
 
-        # Create a custom HTML card layout for the metrics instead of using st.metric
-        html_cards = []
+    def render_dashboard():
+        # Ogni chiamata a lap() registra il tempo della sezione appena disegnata
+        lap = METRICS.laps("render")
+        # Caricamento dei dati: il frame e le statistiche incrementali calcolate sulle stesse righe
+        snapshot = load_data()
+        lap("load")
+        df = snapshot.df
+        stats = snapshot.stats
+
+        if fleet:
+            # Confronto tra le macchine: ultimo campione e media corrente di ogni metrica chiave
+            with st.expander(f"Fleet overview ({len(fleet)} machines)"):
+                st.dataframe(get_fleet_service(tuple(fleet.items())).overview(
+                    [col for _, col, _ in Schema.KEY_METRICS]), use_container_width=True, hide_index=True)
+            st.markdown(f'<div class="section-header">Machine: {st.session_state.machine}</div>',
+                        unsafe_allow_html=True)
+
+        # CONFRONTO ULTIMO CAMPIONE DI COFFEE
+        if not df.empty:
+            # Recupera l'ultimo campione (ultima riga) e i campioni precedenti
+            latest_sample = df.iloc[-1]
+
+            # Finestra recente con cui confrontarlo; su tutto lo storico si usano le statistiche incrementali
+            baseline_label = st.session_state.get('baseline', "All samples")
+            last_n, hours = BASELINE_WINDOWS.get(baseline_label, (None, None))
+            windowed = last_n is not None or (hours is not None and has_timestamps(df))
+            window = window_rows(df, last_n, hours) if windowed else df
+
+            # Esito del controllo anomalie, calcolato dal loader quando il campione è arrivato
+            score = latest_sample.get(Schema.ANOMALY_SCORE, float('nan'))
+            metric = latest_sample.get(Schema.ANOMALY_METRIC)
+            anomaly = anomaly_status(score, metric, latest_sample.get(metric, float('nan')),
+                                     snapshot.ranks.quantile(metric, 0.5), ANOMALY_THRESHOLD) if metric else None
+            badge = ""
+            if anomaly is not None:
+                badge_style = "color: white; padding: 2px 8px; border-radius: 3px; font-size: 0.9rem;"
+                if anomaly.flagged:
+                    badge = (f'<span style="background-color: #ff4b4b; {badge_style}">⚠️ Anomaly: {anomaly.metric} '
+                             f'{anomaly.direction} baseline (score {anomaly.score:.1f})</span>')
+                else:
+                    badge = (f'<span style="background-color: #28a745; {badge_style}">'
+                             f'✅ Normal (score {anomaly.score:.1f})</span>')
+            st.markdown(f'<div class="section-header">Latest coffee overview {badge}</div>', unsafe_allow_html=True)
+
+            # Visualizzazione del Sample ID
+            st.markdown(
+                '<h4 style="color: white; background-color: #333; padding: 5px; border-radius: 5px;">Sample #{}</h4>'.format(
+                    len(df)), unsafe_allow_html=True)
+            details = []
+            if has_timestamps(df):
+                taken = latest_sample[Schema.TIMESTAMP].tz_convert('Europe/Rome').strftime('%Y-%m-%d %H:%M:%S')
+                details.append(f"Taken {taken} (Rome Time)")
+            if windowed:
+                details.append(f"compared with {baseline_label.lower()} ({len(window) - 1} previous samples)")
+            if Schema.ANOMALY_SCORE in window.columns:
+                # The whole history keeps a running count, only a window is rescanned
+                flagged = count_flagged(window[Schema.ANOMALY_SCORE].to_numpy(), ANOMALY_THRESHOLD) \
+                    if windowed else snapshot.flagged
+                details.append(f"{flagged} anomalous samples in {baseline_label.lower()}")
+            if details:
+                st.caption(", ".join(details))
+
+            # Updated key metrics to match radar chart metrics
+            key_metrics = [metric for metric in Schema.KEY_METRICS if metric[1] in df.columns]
+            card_columns = [col for _, col, _ in key_metrics]
+            latest_values = latest_sample[card_columns].to_numpy(dtype='float64')
+
+            # Create a custom HTML card layout for the metrics instead of using st.metric
+            html_cards = []
+
+            # Media dei campioni precedenti dalle statistiche incrementali, senza riscansionare lo storico
+            if windowed:
+                avg_previous = mean_previous(window[card_columns].to_numpy(dtype='float64'))
+            else:
+                avg_previous = stats.mean_without(latest_sample[card_columns]).to_numpy()
 
-        for label, col_name, unit in key_metrics:
-            if col_name in df.columns:
-                value = latest_sample[col_name]
+            for card in card_deltas(latest_values, avg_previous if len(window) > 1 else None, key_metrics):
+                label, value, unit = card.label, card.value, card.unit
 
-                if len(df) > 1:
-                    avg_prev = df.iloc[:-1][col_name].mean()
-                    diff = value - avg_prev
+                if card.compared:
+                    diff = card.delta
                     diff_text = f"{diff:+.1f}{unit}"
 
                     # Color for the difference
@@ -296,344 +412,343 @@ if __name__ == "__main__":
 
                 html_cards.append(card_html)
 
-        # Calculate number of cards per row (based on screen size)
-        num_metrics = len(html_cards)
-        cards_per_row = min(num_metrics, 6)  # Maximum 6 cards per row
-
-        # Create rows of cards
-        rows = []
-        for i in range(0, num_metrics, cards_per_row):
-            row_cards = html_cards[i:i + cards_per_row]
-            card_width = 100 / len(row_cards)
-
-            row_html = f"""
-            <div style="display: flex; flex-wrap: wrap; margin: -5px;">
-                {"".join([f'<div style="flex: 0 0 {card_width}%; padding: 5px;">{card}</div>' for card in row_cards])}
-            </div>
-            """
-            rows.append(row_html)
-
-        # Combine all rows and display
-        st.markdown("".join(rows), unsafe_allow_html=True)
-
-
-        # Creazione di due colonne per immagine/color e grafico radar
-        col1, col2 = st.columns([1, 2])
-
-        with col1:
-            if all(col in df.columns for col in ['Mean_Red', 'Mean_Green', 'Mean_Blue']):
-                r, g, b = int(latest_sample['Mean_Red']), int(latest_sample['Mean_Green']), int(
-                    latest_sample['Mean_Blue'])
-                st.markdown(
-                    f"""
-                    <div style="
-                        width: 100%; 
-                        height: 30px; 
-                        background-color: rgb({r},{g},{b}); 
-                        border-radius: 5px;
-                        margin-top: 10px;
-                        margin-bottom: 5px;
-                    "></div>
-                    <div style="color:white; font-size:0.9rem;">RGB: {r}, {g}, {b}</div>
-                    """,
-                    unsafe_allow_html=True
-                )
-            try:
-                st.image("ImageData.jpg", use_container_width=True)
-            except Exception as e:
-                st.warning(f"Coffee image not available: {e}")
-
-        # Updated radar chart code with your requested metrics
-        with col2:
-            if len(df) > 1:
-                # Exactly the metrics you requested - using both original and mapped column names
-                radar_metrics = [
-                    "Max Temperature (°C)",
-                    "PM1_0_CU",
-                    "PM2_5_CU",
-                    "Average Weight"
-                ]
-
-                # Check for both original and mapped column names for the color metrics
-                if "Mean_H" in df.columns:
-                    radar_metrics.append("Mean_H")
-                elif "mean_H" in df.columns:
-                    radar_metrics.append("mean_H")
-
-                if "Mean_S" in df.columns:
-                    radar_metrics.append("Mean_S")
-                elif "mean_S" in df.columns:
-                    radar_metrics.append("mean_S")
-
-                if radar_metrics:
-                    # Calculate statistics for normalization
-                    avg_previous = df.iloc[:-1][radar_metrics].mean()
-
-                    # Get min and max values for scaling per metric
-                    max_values = df[radar_metrics].max()
-                    min_values = df[radar_metrics].min()
-
-                    # Calculate range while avoiding division by zero
-                    range_values = max_values - min_values
-                    range_values = range_values.replace(0, 1)  # Avoid division by zero
-
-                    # Normalize values to 0-1 scale (0-100%)
-                    latest_normalized = (latest_sample[radar_metrics] - min_values) / range_values
-                    avg_normalized = (avg_previous - min_values) / range_values
-
-                    # Create radar chart
-                    fig = go.Figure()
-
-                    # Add average of previous samples
-                    fig.add_trace(go.Scatterpolar(
-                        r=avg_normalized.values,
-                        theta=radar_metrics,
-                        fill='toself',
-                        name='Average Previous',
-                        line=dict(color='rgba(135, 206, 250, 0.7)'),
-                    ))
-
-                    # Add latest sample
-                    fig.add_trace(go.Scatterpolar(
-                        r=latest_normalized.values,
-                        theta=radar_metrics,
-                        fill='toself',
-                        name='Latest Sample',
-                        line=dict(color='rgba(255, 99, 71, 0.8)'),
-                    ))
-
-                    # Update layout with simplified settings
-                    fig.update_layout(
-                        polar=dict(
-                            radialaxis=dict(
-                                visible=True,
-                                range=[0, 1],
-                                tickvals=[0, 0.25, 0.5, 0.75, 1],
-                                ticktext=['0%', '25%', '50%', '75%', '100%']
-                            )
-                        ),
-                        showlegend=False,  # No legend as requested
-                        margin=dict(l=30, r=30, t=20, b=30),
-                        height=440,
-                        font=dict(color="white")
+            # Calculate number of cards per row (based on screen size)
+            num_metrics = len(html_cards)
+            cards_per_row = min(num_metrics, 6)  # Maximum 6 cards per row
+
+            # Create rows of cards
+            rows = []
+            for i in range(0, num_metrics, cards_per_row):
+                row_cards = html_cards[i:i + cards_per_row]
+                card_width = 100 / len(row_cards)
+
+                row_html = f"""
+                <div style="display: flex; flex-wrap: wrap; margin: -5px;">
+                    {"".join([f'<div style="flex: 0 0 {card_width}%; padding: 5px;">{card}</div>' for card in row_cards])}
+                </div>
+                """
+                rows.append(row_html)
+
+            # Combine all rows and display
+            st.markdown("".join(rows), unsafe_allow_html=True)
+
+
+            # Creazione di due colonne per immagine/color e grafico radar
+            col1, col2 = st.columns([1, 2])
+
+            with col1:
+                if all(col in df.columns for col in ['Mean_Red', 'Mean_Green', 'Mean_Blue']):
+                    r, g, b = int(latest_sample['Mean_Red']), int(latest_sample['Mean_Green']), int(
+                        latest_sample['Mean_Blue'])
+                    st.markdown(
+                        f"""
+                        <div style="
+                            width: 100%; 
+                            height: 30px; 
+                            background-color: rgb({r},{g},{b}); 
+                            border-radius: 5px;
+                            margin-top: 10px;
+                            margin-bottom: 5px;
+                        "></div>
+                        <div style="color:white; font-size:0.9rem;">RGB: {r}, {g}, {b}</div>
+                        """,
+                        unsafe_allow_html=True
                     )
+                try:
+                    st.image("ImageData.jpg", use_container_width=True)
+                except Exception as e:
+                    st.warning(f"Coffee image not available: {e}")
 
-                    st.plotly_chart(fig, use_container_width=True)
-
-                    # Add a simple note about normalization
-                    st.markdown("""
-                    <div style="background-color: rgba(50, 50, 50, 0.7); padding: 8px; border-radius: 5px; font-size: 0.8rem; color: white; margin-top: -15px; text-align: center;">
-                    Each axis normalized 0-100% for proper comparison
-                    </div>
-                    """, unsafe_allow_html=True)
+            # Updated radar chart code with your requested metrics
+            with col2:
+                if len(df) > 1:
+                    # Same metrics as the key metric cards
+                    radar_metrics = card_columns
+
+                    if radar_metrics:
+                        fig = cached_figure("radar", (tuple(radar_metrics), baseline_label), snapshot.fingerprint,
+                                            lambda: radar_chart(radar_axes(radar_metrics, latest_values, avg_previous,
+                                                                           stats.min(radar_metrics).to_numpy(),
+                                                                           stats.max(radar_metrics).to_numpy()),
+                                                                baseline_label if windowed else "Average Previous"))
+                        show_chart("radar", fig)
+
+                        # Add a simple note about normalization
+                        st.markdown("""
+                        <div style="background-color: rgba(50, 50, 50, 0.7); padding: 8px; border-radius: 5px; font-size: 0.8rem; color: white; margin-top: -15px; text-align: center;">
+                        Each axis normalized 0-100% for proper comparison
+                        </div>
+                        """, unsafe_allow_html=True)
+                    else:
+                        st.info("Some of the requested metrics are not available in the data")
                 else:
-                    st.info("Some of the requested metrics are not available in the data")
-            else:
-                st.info("Only one sample available. More samples needed for comparison.")
-
-        st.markdown('<div class="section-header">Historical Sample Analysis</div>', unsafe_allow_html=True)
-
-        tabs = st.tabs([
-            "Temperature",
-            "Particulate",
-            "Color",
-            "Particles",
-            "Weight"
-        ])
-
-        with tabs[0]:
-            temp_metrics = selected_metrics.get("Temperature", [])
-            if temp_metrics:
-                fig = px.line(
-                    df,
-                    x="Sample ID",
-                    y=temp_metrics,
-                    markers=True,
-                    line_shape="spline",
-                    height=280
-                )
-                fig.update_layout(
-                    legend=dict(orientation="h", yanchor="bottom", y=-0.5, xanchor="center", x=0.5),
-                    margin=dict(l=20, r=20, t=10, b=40),
-                    xaxis=dict(tickmode='linear', dtick=1)
-                )
-                st.plotly_chart(fig, use_container_width=True)
+                    st.info("Only one sample available. More samples needed for comparison.")
+            lap("overview")
+
+            st.markdown('<div class="section-header">Historical Sample Analysis</div>', unsafe_allow_html=True)
+
+            # Risoluzione e schede rieseguono solo i grafici storici, non il resto della dashboard
+            def history_panels():
+                # Le risoluzioni temporali leggono i rollup incrementali invece dei campioni grezzi
+                resolutions = ["Samples"] + (list(ROLLUPS) if has_timestamps(df) else [])
+                resolution = st.radio("Resolution", resolutions, horizontal=True, key="resolution") \
+                    if len(resolutions) > 1 else "Samples"
+
+                def history_figure(panel, metrics, **kwargs):
+                    if resolution not in snapshot.rollups:
+                        return cached_figure(panel, metrics, snapshot.fingerprint,
+                                             lambda: history_chart(df, metrics, **kwargs))
+                    return cached_figure(panel, (tuple(metrics), resolution), snapshot.fingerprint,
+                                         lambda: history_chart(snapshot.rollups[resolution].frame(metrics), metrics,
+                                                               x="Time", **kwargs))
+
+                tabs = st.tabs([
+                    "Temperature",
+                    "Particulate",
+                    "Color",
+                    "Particles",
+                    "Weight"
+                ])
+
+                with tabs[0]:
+                    temp_metrics = selected_metrics.get("Temperature", [])
+                    if temp_metrics:
+                        show_chart("temperature", history_figure("temperature", temp_metrics))
+                    else:
+                        st.info("Select temperature metrics in the sidebar")
+
+                with tabs[1]:
+                    pm_metrics = selected_metrics.get("Particulate Matter", [])
+                    if pm_metrics:
+                        show_chart("particulate", history_figure("particulate", pm_metrics))
+                    else:
+                        st.info("Select particulate metrics in the sidebar")
+
+                with tabs[2]:
+                    color_metrics = selected_metrics.get("Color", [])
+                    if color_metrics and 'Mean_Red' in df.columns and 'Mean_Green' in df.columns and 'Mean_Blue' in df.columns:
+                        col1, col2 = st.columns([3, 1])
+                        with col1:
+                            # La colonna occupa 3/4 della pagina
+                            show_chart("color", history_figure("color", color_metrics,
+                                                               width_px=CHART_WIDTH_PX * 3 // 4))
+                        with col2, METRICS.span("render", section="swatches"):
+                            st.markdown("#### Color Swatches")
+                            # Tutta la storia in un'unica immagine, poi una pagina di campioni in un solo blocco HTML
+                            st.markdown(f'<img src="{create_color_visualization(df)}" '
+                                        f'style="width: 100%; height: 20px; border-radius: 3px; margin-bottom: 8px;">',
+                                        unsafe_allow_html=True)
+
+                            # Il cambio di pagina riesegue solo l'elenco dei campioni
+                            def swatch_page():
+                                pages = max((len(df) - 1) // SWATCH_PAGE_SIZE + 1, 1)
+                                page = st.number_input("Page", min_value=1, max_value=pages, value=pages,
+                                                       key="swatch_page") if pages > 1 else 1
+                                start = (page - 1) * SWATCH_PAGE_SIZE
+                                page_rgb = color_array(df.iloc[start:start + SWATCH_PAGE_SIZE])
+                                page_ids = df['Sample ID'].iloc[start:start + SWATCH_PAGE_SIZE].to_numpy()
+                                st.markdown("".join(
+                                    f'<div style="display: flex; align-items: center; margin-bottom: 5px; font-size: 0.8rem;">'
+                                    f'<div style="flex: 0 0 20px; margin-right: 5px;">#{sample_id}</div>'
+                                    f'<div style="flex: 1; height: 15px; background-color: rgb({r},{g},{b}); border-radius: 3px;"></div>'
+                                    f'</div>'
+                                    for sample_id, (r, g, b) in zip(page_ids, page_rgb)
+                                ), unsafe_allow_html=True)
+
+                            st.fragment(swatch_page)()
+                    else:
+                        st.info("Select color metrics in the sidebar")
+
+                with tabs[3]:
+                    particles_metrics = selected_metrics.get("Particles", [])
+                    if particles_metrics:
+                        show_chart("particles", history_figure("particles", particles_metrics, kind="bar"))
+                    else:
+                        st.info("Select particle metrics in the sidebar")
+
+                with tabs[4]:
+                    weight_metrics = selected_metrics.get("Weight", [])
+                    if weight_metrics:
+                        show_chart("weight", history_figure("weight", weight_metrics))
+                    else:
+                        st.info("Select weight metrics in the sidebar")
+
+            st.fragment(history_panels)()
+            lap("history")
+
+            st.markdown('<div class="section-header">Statistical Analysis</div>', unsafe_allow_html=True)
+
+            all_selected = []
+            for metrics in selected_metrics.values():
+                all_selected.extend(metrics)
+
+            if len(all_selected) >= 2:
+                def build_heatmap():
+                    # Sotto-matrice letta dall'accumulatore incrementale, O(k²) senza rileggere lo storico
+                    if snapshot.cov.covers(all_selected) and not windowed:
+                        return correlation_heatmap(snapshot.cov.corr(all_selected))
+                    matrix = correlation_matrix(window[all_selected].to_numpy(dtype='float64'))
+                    return correlation_heatmap(pd.DataFrame(matrix, index=all_selected, columns=all_selected))
+
+                fig = cached_figure("correlation", (tuple(all_selected), baseline_label), snapshot.fingerprint,
+                                    build_heatmap)
+                show_chart("correlation", fig)
             else:
-                st.info("Select temperature metrics in the sidebar")
-
-        with tabs[1]:
-            pm_metrics = selected_metrics.get("Particulate Matter", [])
-            if pm_metrics:
-                fig = px.line(
-                    df,
-                    x="Sample ID",
-                    y=pm_metrics,
-                    markers=True,
-                    line_shape="spline",
-                    height=280
-                )
-                fig.update_layout(
-                    legend=dict(orientation="h", yanchor="bottom", y=-0.5, xanchor="center", x=0.5),
-                    margin=dict(l=20, r=20, t=10, b=40),
-                    xaxis=dict(tickmode='linear', dtick=1)
-                )
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("Select particulate metrics in the sidebar")
-
-        with tabs[2]:
-            color_metrics = selected_metrics.get("Color", [])
-            if color_metrics and 'Mean_Red' in df.columns and 'Mean_Green' in df.columns and 'Mean_Blue' in df.columns:
-                col1, col2 = st.columns([3, 1])
-                with col1:
-                    fig = px.line(
-                        df,
-                        x="Sample ID",
-                        y=color_metrics,
-                        markers=True,
-                        line_shape="spline",
-                        height=280
-                    )
-                    fig.update_layout(
-                        legend=dict(orientation="h", yanchor="bottom", y=-0.5, xanchor="center", x=0.5),
-                        margin=dict(l=20, r=20, t=10, b=40),
-                        xaxis=dict(tickmode='linear', dtick=1)
-                    )
-                    st.plotly_chart(fig, use_container_width=True)
-                with col2:
-                    st.markdown("#### Color Swatches")
-                    for i in range(len(df)):
-                        r, g, b = int(df.iloc[i]['Mean_Red']), int(df.iloc[i]['Mean_Green']), int(
-                            df.iloc[i]['Mean_Blue'])
-                        sample_id = i + 1
-                        st.markdown(
-                            f"""
-                            <div style="display: flex; align-items: center; margin-bottom: 5px; font-size: 0.8rem;">
-                                <div style="flex: 0 0 20px; margin-right: 5px;">#{sample_id}</div>
-                                <div style="
-                                    flex: 1;
-                                    height: 15px; 
-                                    background-color: rgb({r},{g},{b}); 
-                                    border-radius: 3px;
-                                "></div>
-                            </div>
-                            """,
-                            unsafe_allow_html=True
+                st.info("Select at least 2 metrics to view correlations")
+
+            col1, col2 = st.columns(2)
+            with col1:
+                # Il selettore delle metriche riesegue solo il grafico dei ranghi
+                def rank_panel():
+                    if len(df) > 1:
+                        # Ogni colonna dello schema è indicizzata, il ranking può includere qualsiasi sensore
+                        rankable = [col for col in Schema.COLUMN_SCHEMA if col != 'id' and col in df.columns]
+                        default_ranks = ["Max Temperature (°C)", "PM2_5_CU", "particles_beyond_0_3"]
+                        rank_metrics = st.multiselect(
+                            "Ranked metrics",
+                            options=rankable,
+                            default=[m for m in default_ranks if m in rankable],
+                            key="rank_metrics"
                         )
-            else:
-                st.info("Select color metrics in the sidebar")
-
-        with tabs[3]:
-            particles_metrics = selected_metrics.get("Particles", [])
-            if particles_metrics:
-                fig = px.bar(
-                    df,
-                    x="Sample ID",
-                    y=particles_metrics,
-                    barmode="group",
-                    height=280
-                )
-                fig.update_layout(
-                    legend=dict(orientation="h", yanchor="bottom", y=-0.5, xanchor="center", x=0.5),
-                    margin=dict(l=20, r=20, t=10, b=40),
-                    xaxis=dict(tickmode='linear', dtick=1)
-                )
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("Select particle metrics in the sidebar")
-
-        with tabs[4]:
-            weight_metrics = selected_metrics.get("Weight", [])
-            if weight_metrics:
-                fig = px.line(
-                    df,
-                    x="Sample ID",
-                    y=weight_metrics,
-                    markers=True,
-                    line_shape="spline",
-                    height=280
-                )
-                fig.update_layout(
-                    legend=dict(orientation="h", yanchor="bottom", y=-0.5, xanchor="center", x=0.5),
-                    margin=dict(l=20, r=20, t=10, b=40),
-                    xaxis=dict(tickmode='linear', dtick=1)
-                )
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("Select weight metrics in the sidebar")
-
-        st.markdown('<div class="section-header">Statistical Analysis</div>', unsafe_allow_html=True)
-
-        all_selected = []
-        for metrics in selected_metrics.values():
-            all_selected.extend(metrics)
-
-        if len(all_selected) >= 2:
-            corr = df[all_selected].corr()
-            fig = px.imshow(
-                corr,
-                text_auto=True,
-                color_continuous_scale='RdBu_r',
-                zmin=-1, zmax=1,
-                height=600
-            )
-            fig.update_layout(
-                margin=dict(l=10, r=10, t=30, b=10)
-            )
-            fig.update_traces(textfont=dict(size=10))
-            st.plotly_chart(fig, use_container_width=True)
+                        if rank_metrics:
+                            # Ricerca binaria sull'indice ordinato mantenuto dal loader, o su quello della finestra
+                            def build_ranks():
+                                if not windowed:
+                                    return percentile_chart(
+                                        snapshot.ranks.percentile_ranks(latest_sample[rank_metrics]).to_dict())
+                                ranks = percentile_ranks(sorted_columns(window[rank_metrics].to_numpy(dtype='float64')),
+                                                         latest_sample[rank_metrics].to_numpy(dtype='float64'))
+                                return percentile_chart(dict(zip(rank_metrics, ranks)))
+
+                            fig = cached_figure("percentile", (tuple(rank_metrics), baseline_label),
+                                                snapshot.fingerprint, build_ranks)
+                            show_chart("percentile", fig)
+                        else:
+                            st.info("Key metrics not available for ranking")
+                    else:
+                        st.info("Need more samples for percentile ranking")
+
+                st.fragment(rank_panel)()
+            with col2:
+                st.write("")
+            lap("statistics")
+            # Filtri e pagine del viewer rieseguono solo questo pannello, senza reinviare i grafici
+            def raw_data_panel():
+                with st.expander("View Raw Data"):
+                    # Filtri e ordinamento applicati lato server, al frontend arriva solo la pagina visibile
+                    filter_col1, filter_col2, filter_col3 = st.columns([2, 2, 1])
+                    with filter_col1:
+                        first_id, last_id = int(df['Sample ID'].iloc[0]), int(df['Sample ID'].iloc[-1])
+                        id_range = st.slider("Sample ID range", first_id, last_id, (first_id, last_id),
+                                             key="raw_id_range") if last_id > first_id else (first_id, last_id)
+                    numeric_columns = [col for col in df.columns if col in Schema.COLUMN_SCHEMA and col != 'id']
+                    with filter_col2:
+                        threshold_column = st.selectbox("Threshold column", [None] + numeric_columns,
+                                                        key="raw_threshold_column")
+                    thresholds = {}
+                    if threshold_column is not None:
+                        with filter_col3:
+                            low = st.number_input("Min", value=float(stats.min([threshold_column]).iloc[0]),
+                                                  key="raw_threshold_min")
+                            high = st.number_input("Max", value=float(stats.max([threshold_column]).iloc[0]),
+                                                   key="raw_threshold_max")
+                        thresholds[threshold_column] = (low, high)
+
+                    sort_col1, sort_col2, sort_col3, sort_col4 = st.columns([2, 1, 1, 1])
+                    with sort_col1:
+                        sort_by = st.selectbox("Sort by", [None] + list(df.columns), key="raw_sort_by")
+                    with sort_col2:
+                        ascending = st.toggle("Ascending", value=True, key="raw_ascending")
+                    with sort_col3:
+                        page_size = st.selectbox("Rows", [50, 100, 500], key="raw_page_size")
+                    _, total = query_window(df, 0, 0, sort_by, ascending, id_range, thresholds, snapshot.fingerprint)
+                    raw_pages = max((total - 1) // page_size + 1, 1)
+                    with sort_col4:
+                        raw_page = st.number_input("Page", min_value=1, max_value=raw_pages, value=1, key="raw_page")
+                    page_df, total = query_window(df, (raw_page - 1) * page_size, page_size, sort_by, ascending,
+                                                  id_range, thresholds, snapshot.fingerprint)
+
+                    st.markdown('<div class="dataframe-container">', unsafe_allow_html=True)
+                    st.dataframe(page_df, use_container_width=True, height=200)
+                    st.markdown('</div>', unsafe_allow_html=True)
+                    st.caption(f"Rows {min((raw_page - 1) * page_size + 1, total)}-"
+                               f"{min(raw_page * page_size, total)} of {total} matching ({len(df)} total)")
+
+                    # Export generato solo al click (su un thread separato), con gli stessi filtri del viewer
+                    export_col1, export_col2 = st.columns([1, 2])
+                    with export_col1:
+                        export_format = st.selectbox("Format", list(EXPORT_FORMATS), key="export_format")
+                    extension, mime = EXPORT_FORMATS[export_format]
+                    with export_col2:
+                        st.download_button(
+                            f"Download {export_format}",
+                            data=lambda: export_bytes(select_rows(df, id_range, thresholds=thresholds), export_format),
+                            file_name=f"coffee_assessment_data_{time.strftime('%Y%m%d_%H%M%S')}.{extension}",
+                            mime=mime,
+                        )
+
+            st.fragment(raw_data_panel)()
+            lap("raw_data")
         else:
-            st.info("Select at least 2 metrics to view correlations")
-
-        col1, col2 = st.columns(2)
-        with col1:
-            if len(df) > 1:
-                rank_metrics = ["Max Temperature (°C)", "PM2_5_CU", "particles_beyond_0_3"]
-                rank_metrics = [m for m in rank_metrics if m in df.columns]
-                if rank_metrics:
-                    percentile_ranks = {}
-                    for metric in rank_metrics:
-                        all_values = df[metric].sort_values().values
-                        latest_value = latest_sample[metric]
-                        percentile = sum(all_values < latest_value) / len(all_values) * 100
-                        percentile_ranks[metric] = percentile
-                    fig = px.bar(
-                        x=list(percentile_ranks.keys()),
-                        y=list(percentile_ranks.values()),
-                        labels={'x': 'Metric', 'y': 'Percentile Rank'},
-                        height=300,
-                        text=[f"{p:.1f}%" for p in percentile_ranks.values()]
-                    )
-                    fig.update_layout(
-                        margin=dict(l=10, r=10, t=30, b=10),
-                        title="Latest Sample Percentile Rank",
-                        yaxis=dict(range=[0, 100])
-                    )
-                    fig.update_traces(textposition='outside')
-                    st.plotly_chart(fig, use_container_width=True)
-                else:
-                    st.info("Key metrics not available for ranking")
-            else:
-                st.info("Need more samples for percentile ranking")
-        with col2:
-            st.write("")
-        with st.expander("View Raw Data"):
-            st.markdown('<div class="dataframe-container">', unsafe_allow_html=True)
-            st.dataframe(df, use_container_width=True, height=200)
-            st.markdown('</div>', unsafe_allow_html=True)
-            st.download_button(
-                "Download CSV",
-                data=df.to_csv(index=False).encode('utf-8'),
-                file_name=f"coffee_assessment_data_{time.strftime('%Y%m%d_%H%M%S')}.csv",
-                mime="text/csv",
-            )
-    else:
-        st.warning("No data available. Please check your connection or enable Demo Mode in the sidebar.")
-
-    rome_tz = pytz.timezone('Europe/Rome')
-    rome_time = datetime.now(rome_tz).strftime('%Y-%m-%d %H:%M:%S')
-    st.markdown(f"""
-    <div style="text-align: center; font-size: 0.8rem; margin-top: 1rem; color: #666;">
-        Last updated: {rome_time} (Rome Time) | Total Samples: {len(df)}
-    </div>
-    """, unsafe_allow_html=True)
\ No newline at end of file
+            st.warning("No data available. Please check your connection or enable Demo Mode in the sidebar.")
+
+        rome_tz = pytz.timezone('Europe/Rome')
+        rome_time = datetime.now(rome_tz).strftime('%Y-%m-%d %H:%M:%S')
+        st.markdown(f"""
+        <div style="text-align: center; font-size: 0.8rem; margin-top: 1rem; color: #666;">
+            Last updated: {rome_time} (Rome Time) | Total Samples: {len(df)}
+        </div>
+        """, unsafe_allow_html=True)
+
+
+    # I widget dei pannelli rieseguono solo il fragment, non CSS e sidebar
+    st.fragment(render_dashboard)()
+
+
+    # 📌 Pannello diagnostico: tempi per fase, contatori e memoria del processo (cumulativi per processo)
+    def render_diagnostics():
+        snapshot = METRICS.snapshot()
+        with st.expander("Diagnostics", expanded=True):
+            timings = sorted(snapshot['timings'], key=lambda t: -t['total'])
+            st.dataframe([{
+                'Span': t['name'],
+                'Labels': ", ".join(f"{key}={value}" for key, value in t['labels'].items()),
+                'Count': t['count'],
+                'Mean (ms)': round(t['total'] / t['count'] * 1000, 2),
+                'Last (ms)': round(t['last'] * 1000, 2),
+                'Max (ms)': round(t['max'] * 1000, 2),
+            } for t in timings], use_container_width=True, hide_index=True)
+            col1, col2 = st.columns(2)
+            with col1:
+                st.markdown("#### Counters")
+                st.dataframe([{
+                    'Counter': c['name'],
+                    'Labels': ", ".join(f"{key}={value}" for key, value in c['labels'].items()),
+                    'Value': c['value'],
+                } for c in snapshot['counters']], use_container_width=True, hide_index=True)
+            with col2:
+                st.markdown("#### Gauges")
+                st.dataframe([{
+                    'Gauge': g['name'],
+                    'Labels': ", ".join(f"{key}={value}" for key, value in g['labels'].items()),
+                    'Value': g['value'],
+                } for g in snapshot['gauges']], use_container_width=True, hide_index=True)
+            if metrics_port:
+                st.caption(f"Prometheus endpoint: http://127.0.0.1:{metrics_port}/metrics")
+
+
+    if st.session_state.diagnostics:
+        render_diagnostics()
+
+
+    # La pagina viene rieseguita solo quando il servizio dati pubblica una nuova versione: il controllo
+    # periodico confronta due tuple e non disegna nulla finché i dati non cambiano. Rerun dell'app perché
+    # anche la sidebar dipende dai dati (colonne, finestre temporali) e un fragment non può rieseguirne un altro.
+    def watch_data():
+        if data_fingerprint() != st.session_state.get('data_fingerprint'):
+            st.rerun(scope="app")
+
+
+    if st.session_state.live_updates:
+        st.fragment(run_every=WATCH_INTERVAL)(watch_data)()
+
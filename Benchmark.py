@@ -0,0 +1,230 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import Schema
+from Analytics import radar_axes
+from Charts import correlation_heatmap, history_chart, percentile_chart, radar_chart
+from Data import TailLoader, query_window
+from Export import export_bytes
+from Metrics import peak_resident_bytes
+from Sources import LOCAL_CSV, CsvFileSource
+from Storage import ArrowStore, sidecar_path
+
+# 📌 Dimensioni di default del benchmark (righe del CSV sintetico)
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+GENERATE_CHUNK_ROWS = 500_000  # Righe generate e scritte per volta
+SAMPLE_INTERVAL = "3min"  # Intervallo tra due campioni sintetici
+
+
+def column_profile(template: Optional[str] = LOCAL_CSV) -> Dict[str, tuple]:
+    """
+    Source column name -> (mean, std) for the generator, taken from a real CSV when available so
+    the synthetic rows look like real ones; schema columns missing from it get generic values
+    """
+    real = pd.read_csv(template) if template and os.path.exists(template) else pd.DataFrame()
+    profile = {}
+    for display in Schema.COLUMN_SCHEMA:
+        if display == 'id':
+            continue
+        source = Schema.SOURCE_NAMES.get(display, display)
+        column = real[source] if source in real.columns else pd.Series(dtype=float)
+        mean = column.mean() if len(column) else 1.0
+        std = column.std() if len(column) > 1 else abs(mean) * 0.1
+        profile[source] = (float(mean), float(std) if std == std and std > 0 else abs(float(mean)) * 0.1 + 1e-3)
+    return profile
+
+
+def generate_csv(path: str, rows: int, seed: int = 0, template: Optional[str] = LOCAL_CSV,
+                 timestamps: bool = True) -> str:
+    """
+    Write a synthetic history with the real column set (source names, as written by the rig),
+    values drawn around the template statistics and clipped to the schema bounds
+    """
+    rng = np.random.default_rng(seed)
+    profile = column_profile(template)
+    start = pd.Timestamp("2025-01-01T06:00:00Z")
+    with open(path, 'w', newline='') as f:
+        for first in range(0, rows, GENERATE_CHUNK_ROWS):
+            n = min(GENERATE_CHUNK_ROWS, rows - first)
+            chunk = {'id': np.arange(first + 1, first + n + 1)}
+            for source, (mean, std) in profile.items():
+                _, low, high = Schema.COLUMN_SCHEMA[Schema.DISPLAY_NAMES.get(source, source)]
+                chunk[source] = np.clip(rng.normal(mean, std, n), low, high)
+            if timestamps:
+                offsets = pd.to_timedelta(np.arange(first, first + n) * pd.Timedelta(SAMPLE_INTERVAL).total_seconds(),
+                                          unit="s")
+                chunk[Schema.TIMESTAMP] = (start + offsets).strftime("%Y-%m-%dT%H:%M:%SZ")
+            pd.DataFrame(chunk).to_csv(f, index=False, header=first == 0)
+    return path
+
+
+def measure(stage: str, rows: int, func: Callable[[], object], repeat: int = 3,
+            setup: Optional[Callable[[], object]] = None) -> dict:
+    """
+    Median and min wall time over `repeat` runs, then one traced run for the peak memory allocated
+    by the stage (numpy and pandas buffers included). setup runs untimed before every run.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'stage': stage,
+        'rows': rows,
+        'seconds': statistics.median(timings),
+        'min_seconds': min(timings),
+        'peak_mb': peak / 2 ** 20,
+    }
+
+
+def prepare_rows(new_rows: pd.DataFrame) -> pd.DataFrame:
+    # Come nella dashboard: "Sample ID" numerato dall'indice continuo del loader
+    new_rows['Sample ID'] = new_rows.index + 1
+    return new_rows
+
+
+def run_size(rows: int, directory: str, repeat: int = 3, seed: int = 0) -> List[dict]:
+    """
+    Time every dashboard stage on a synthetic history of `rows` samples
+    """
+    path = generate_csv(os.path.join(directory, f"bench-{rows}.csv"), rows, seed)
+    results = [measure("parse", rows, lambda: TailLoader(CsvFileSource(path), transform=prepare_rows).refresh(),
+                       repeat)]
+
+    # Riavvio da sidecar: lo store viene scritto una volta, poi si misura solo la ripresa
+    sidecar = ArrowStore(sidecar_path(path))
+    TailLoader(CsvFileSource(path, sidecar)).refresh()
+    results.append(measure("restart from sidecar", rows,
+                           lambda: TailLoader(CsvFileSource(path, sidecar), transform=prepare_rows).refresh(),
+                           repeat))
+
+    loader = TailLoader(CsvFileSource(path), transform=prepare_rows)
+    df = loader.refresh()
+    results.append(measure_append(path, rows, repeat))
+
+    latest = df.iloc[-1]
+    key_metrics = [col for _, col, _ in Schema.KEY_METRICS]
+    sensors = [col for col in Schema.COLUMN_SCHEMA if col != 'id']
+
+    def axes():
+        return radar_axes(key_metrics, latest[key_metrics].to_numpy(dtype=np.float64),
+                          loader.stats.mean_without(latest[key_metrics]).to_numpy(),
+                          loader.stats.min(key_metrics).to_numpy(), loader.stats.max(key_metrics).to_numpy())
+
+    # Calcolo e costruzione della figura sono stadi separati: "corr (incremental)" si confronta
+    # con "corr (pandas)" a parità di lavoro, e il costo di plotly resta visibile a parte
+    radar = axes()
+    ranks = loader.ranks.percentile_ranks(latest[sensors]).to_dict()
+    corr = loader.cov.corr(sensors)
+    results += [
+        measure("metric cards", rows, lambda: loader.stats.mean_without(latest[key_metrics]), repeat),
+        measure("radar", rows, axes, repeat),
+        measure("radar figure", rows, lambda: radar_chart(radar), repeat),
+        measure("percentile ranks", rows, lambda: loader.ranks.percentile_ranks(latest[sensors]), repeat),
+        measure("percentile figure", rows, lambda: percentile_chart(ranks), repeat),
+        measure("corr (incremental)", rows, lambda: loader.cov.corr(sensors), repeat),
+        measure("corr (pandas)", rows, lambda: df[sensors].corr(), repeat),
+        measure("corr figure", rows, lambda: correlation_heatmap(corr), repeat),
+        measure("history figure", rows, lambda: history_chart(df, key_metrics[:3]), repeat),
+        measure("history figure (bar)", rows, lambda: history_chart(df, key_metrics[:3], kind="bar"), repeat),
+        measure("rollup figure (hour)", rows,
+                lambda: history_chart(loader.rollups["Hour"].frame(key_metrics[:3]), key_metrics[:3], x="Time"),
+                repeat),
+        measure("raw data page (sorted)", rows, lambda: query_window(df, 0, 50, sort_by="PM2_5_CU"), repeat),
+        measure("export csv", rows, lambda: export_bytes(df, "CSV"), repeat),
+        measure("export parquet", rows, lambda: export_bytes(df, "Parquet"), repeat),
+    ]
+    return results
+
+
+def measure_append(path: str, rows: int, repeat: int = 3, batch: int = 100) -> dict:
+    """
+    Incremental refresh of a loaded history after the rig appended `batch` rows: tail read, parse,
+    scoring and accumulator updates (the history copy is made on a separate CSV file)
+    """
+    copy_path = path[:-4] + "-append.csv"
+    with open(path, 'rb') as src, open(copy_path, 'wb') as dst:
+        dst.write(src.read())
+    loader = TailLoader(CsvFileSource(copy_path), transform=prepare_rows)
+    loader.refresh()
+    template = pd.read_csv(copy_path, nrows=batch)
+    next_id = rows + 1
+
+    def append():
+        nonlocal next_id
+        template.assign(id=np.arange(next_id, next_id + batch)).to_csv(copy_path, mode='a', index=False,
+                                                                      header=False)
+        next_id += batch
+
+    return measure(f"append {batch} rows", rows, loader.refresh, repeat, setup=append)
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'time': pd.Timestamp.now(tz="UTC").isoformat(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard stages on synthetic histories")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_SIZES, help="History sizes to test")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage (the median is reported)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file")
+    parser.add_argument("--generate", metavar="CSV", help="Only write a synthetic history of --rows rows to CSV")
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_csv(args.generate, args.rows[0], args.seed)
+        print(f"Wrote {args.rows[0]} synthetic samples to {args.generate}")
+        sys.exit()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="coffee-bench-") as directory:
+        for rows in args.rows:
+            for result in run_size(rows, directory, args.repeat, args.seed):
+                # Riepilogo leggibile su stderr, il JSON resta pulito su stdout
+                print(f"{result['rows']:>10} {result['stage']:<24} {result['seconds'] * 1000:>10.1f} ms "
+                      f"{result['peak_mb']:>9.1f} MB", file=sys.stderr)
+                results.append(result)
+
+    report = dict(environment(), max_rss_mb=peak_resident_bytes() / 2 ** 20,
+                  results=results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
@@ -1,5 +1,20 @@
 import streamlit as st
 import plotly.express as px
+import plotly.graph_objects as go
+import numpy as np
+import pandas as pd
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Tuple
+
+from Analytics import RadarAxes
+from Metrics import METRICS
+
+# 📌 Parametri di downsampling dei grafici storici
+CHART_WIDTH_PX = 1200  # Larghezza di riferimento di un grafico a tutta pagina
+POINTS_PER_PIXEL = 2  # Oltre questa densità i punti non si distinguono più
+WEBGL_THRESHOLD = 2000  # Punti per traccia oltre i quali si passa a Scattergl
+FIGURE_CACHE_SIZE = 64  # Figure tenute in memoria, condivise da tutte le sessioni
 
 def display_charts(df):
     st.markdown("### 📊 Analisi dei Dati")
@@ -29,3 +44,233 @@ def display_charts(df):
     st.subheader("📊 Distribuzione dei Valori Massimi")
     fig_max = px.scatter(df, x=df.index, y="Max Value", title="Distribuzione dei Valori Massimi")
     st.plotly_chart(fig_max, use_container_width=True)
+
+
+def max_points_for_width(width_px: int = CHART_WIDTH_PX) -> int:
+    """
+    Number of points per trace worth sending for a chart of the given width
+    """
+    return max(int(width_px * POINTS_PER_PIXEL), 3)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: indices of `threshold` points that keep the visual shape of the series
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = (x.view(np.int64) if x.dtype.kind == 'M' else x).astype(np.float64)
+    y = np.nan_to_num(y.astype(np.float64), nan=np.nanmean(y) if not np.isnan(y).all() else 0.0)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start = edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        # Area of the triangle (previous point, candidate, average of the next bucket)
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(y: np.ndarray, buckets: int) -> np.ndarray:
+    """
+    Min/max bucketing: first, last, minimum and maximum of each bucket (keeps the peaks for bar charts)
+    """
+    n = len(y)
+    if buckets * 2 >= n:
+        return np.arange(n)
+    y = np.nan_to_num(y.astype(np.float64), nan=0.0)
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    indices = [0, n - 1]
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end > start:
+            chunk = y[start:end]
+            indices.extend((start + int(chunk.argmin()), start + int(chunk.argmax())))
+    return np.unique(indices)
+
+
+def downsample(df: pd.DataFrame, x: str, columns: List[str], max_points: int, method: str = "lttb") -> pd.DataFrame:
+    """
+    Rows to plot for the given columns: the union of the points each series needs
+    """
+    if len(df) <= max_points:
+        return df
+    x_values = df[x].to_numpy()
+    if method == "minmax":
+        indices = [minmax_indices(df[col].to_numpy(), max_points // 2) for col in columns]
+    else:
+        indices = [lttb_indices(x_values, df[col].to_numpy(), max_points) for col in columns]
+    return df.iloc[np.unique(np.concatenate(indices))]
+
+
+def history_chart(df: pd.DataFrame, metrics: List[str], kind: str = "line", height: int = 280,
+                  width_px: int = CHART_WIDTH_PX, webgl_threshold: int = WEBGL_THRESHOLD, x: str = "Sample ID"):
+    """
+    Figure for a historical tab: downsampled to the chart width, WebGL above webgl_threshold points.
+    x is "Sample ID" for raw samples, or "Time" for the frames of a time rollup.
+    """
+    max_points = max_points_for_width(width_px)
+    if kind == "bar":
+        plot_df = downsample(df, x, metrics, max_points, method="minmax")
+        fig = px.bar(plot_df, x=x, y=metrics, barmode="group", height=height)
+    else:
+        plot_df = downsample(df, x, metrics, max_points)
+        if len(plot_df) > webgl_threshold:
+            # Scattergl non supporta le spline, a questa densità le linee dritte sono indistinguibili
+            fig = px.line(plot_df, x=x, y=metrics, render_mode="webgl", height=height)
+        else:
+            fig = px.line(plot_df, x=x, y=metrics, markers=True, line_shape="spline", height=height)
+
+    # Un tick per campione solo finché restano leggibili
+    xaxis = dict(tickmode='linear', dtick=1) if len(df) <= 30 and x == "Sample ID" else dict()
+    fig.update_layout(
+        legend=dict(orientation="h", yanchor="bottom", y=-0.5, xanchor="center", x=0.5),
+        margin=dict(l=20, r=20, t=10, b=40),
+        xaxis=xaxis
+    )
+    return fig
+
+
+class FigureCache:
+    """
+    Process-wide LRU cache of Plotly figures keyed by (panel, selection, data fingerprint), with the
+    size of their JSON payload. Cached figures are shared between sessions and must not be modified
+    after building.
+    """
+
+    def __init__(self, max_entries: int = FIGURE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.payloads: Dict[str, int] = {}  # Pannello -> byte dell'ultima figura costruita
+        self._figures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, build: Callable[[], go.Figure]) -> Tuple[go.Figure, int]:
+        """
+        The figure and its payload in bytes (the JSON handed to st.plotly_chart)
+        """
+        with self._lock:
+            if key in self._figures:
+                self._figures.move_to_end(key)
+                self.hits += 1
+                return self._figures[key]
+            self.misses += 1
+        # Build outside the lock, two sessions racing on the same key just build it twice
+        panel = key[0] if isinstance(key, tuple) else key
+        with METRICS.span("figure_build", panel=panel):
+            fig = build()
+            entry = fig, len(fig.to_json())
+        with self._lock:
+            self._figures[key] = entry
+            self._figures.move_to_end(key)
+            self.payloads[panel] = entry[1]
+            while len(self._figures) > self.max_entries:
+                self._figures.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+
+
+FIGURE_CACHE = FigureCache()
+METRICS.register(lambda: [("figure_cache_hits", {}, FIGURE_CACHE.hits),
+                          ("figure_cache_misses", {}, FIGURE_CACHE.misses),
+                          ("figure_cache_entries", {}, len(FIGURE_CACHE._figures))]
+                 + [("figure_payload_bytes", {'panel': panel}, float(size))
+                    for panel, size in list(FIGURE_CACHE.payloads.items())])
+
+
+def cached_figure(panel: str, selection, data_key: Hashable, build: Callable[[], go.Figure]) -> go.Figure:
+    """
+    Figure for a panel, rebuilt only when the selection or the data fingerprint changes; the bytes of
+    every figure handed out (then sent with st.plotly_chart) are counted per panel
+    """
+    selection = tuple(selection) if isinstance(selection, (list, tuple)) else selection
+    fig, payload = FIGURE_CACHE.get((panel, selection, data_key), build)
+    METRICS.count("chart_payload_bytes", payload, panel=panel)
+    return fig
+
+
+def radar_chart(axes: RadarAxes, baseline_name: str = "Average Previous") -> go.Figure:
+    """
+    Radar of the latest sample against the average of the previous ones (or of a recent baseline
+    window), with the axes already normalized by Analytics.radar_axes
+    """
+    # Create radar chart
+    fig = go.Figure()
+
+    # Add average of previous samples
+    fig.add_trace(go.Scatterpolar(
+        r=axes.baseline,
+        theta=axes.metrics,
+        fill='toself',
+        name=baseline_name,
+        line=dict(color='rgba(135, 206, 250, 0.7)'),
+    ))
+
+    # Add latest sample
+    fig.add_trace(go.Scatterpolar(
+        r=axes.latest,
+        theta=axes.metrics,
+        fill='toself',
+        name='Latest Sample',
+        line=dict(color='rgba(255, 99, 71, 0.8)'),
+    ))
+
+    # Update layout with simplified settings
+    fig.update_layout(
+        polar=dict(
+            radialaxis=dict(
+                visible=True,
+                range=[0, 1],
+                tickvals=[0, 0.25, 0.5, 0.75, 1],
+                ticktext=['0%', '25%', '50%', '75%', '100%']
+            )
+        ),
+        showlegend=False,  # No legend as requested
+        margin=dict(l=30, r=30, t=20, b=30),
+        height=440,
+        font=dict(color="white")
+    )
+    return fig
+
+
+def correlation_heatmap(corr: pd.DataFrame) -> go.Figure:
+    fig = px.imshow(
+        corr,
+        text_auto=True,
+        color_continuous_scale='RdBu_r',
+        zmin=-1, zmax=1,
+        height=600
+    )
+    fig.update_layout(
+        margin=dict(l=10, r=10, t=30, b=10)
+    )
+    fig.update_traces(textfont=dict(size=10))
+    return fig
+
+
+def percentile_chart(percentile_ranks: dict) -> go.Figure:
+    fig = px.bar(
+        x=list(percentile_ranks.keys()),
+        y=list(percentile_ranks.values()),
+        labels={'x': 'Metric', 'y': 'Percentile Rank'},
+        height=300,
+        text=[f"{p:.1f}%" for p in percentile_ranks.values()]
+    )
+    fig.update_layout(
+        margin=dict(l=10, r=10, t=30, b=10),
+        title="Latest Sample Percentile Rank",
+        yaxis=dict(range=[0, 100])
+    )
+    fig.update_traces(textposition='outside')
+    return fig
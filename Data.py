@@ -1,9 +1,559 @@
-import pandas as pd
+import os
+import random
+import threading
 import time
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import pandas as pd
+
+import Schema
+from Analytics import count_flagged
+from Export import row_mask
+from Metrics import METRICS
+from Sources import ArrowSource, CsvFileSource, HttpCsvSource, SQLiteSource, configured_source, open_source
+from Stats import RunningCovariance, RunningStats, SortedIndex, TimeRollup, family_threshold, robust_zscores
+
+try:
+    from watchdog.observers import Observer
+except ImportError:  # Senza watchdog le sorgenti locali vengono lette a ogni intervallo di polling
+    Observer = None
+
+POLL_INTERVAL = 5  # Secondi tra due controlli della sorgente
+SORT_CACHE_SIZE = 8  # Ordinamenti del viewer tenuti in memoria
+FLEET_WORKERS = 8  # Thread condivisi per il polling delle macchine in fleet mode
+BACKOFF_MAX = 300  # Attesa massima (secondi) tra due tentativi dopo errori consecutivi
+ANOMALY_THRESHOLD = 3.5  # Z-score robusto oltre il quale un campione è segnalato (come per una sola metrica)
+ANOMALY_MIN_SCALE = 0.02  # Scala minima di una colonna, in frazione del suo intervallo osservato
+LOCAL_TZ = "Europe/Rome"  # Fuso orario dell'impianto, per turni e giorni
+HISTORY_GROWTH = 1.5  # Fattore di crescita della capacità preallocata della storia
+
+# 📌 Aggregazioni temporali mantenute incrementalmente: nome -> (durata del bucket, inizio)
+ROLLUPS: Dict[str, Tuple[str, str]] = {
+    "Hour": ("1h", "0h"),
+    "Shift": ("8h", "6h"),  # Turni 06-14, 14-22, 22-06
+    "Day": ("1D", "0h"),
+}
+
+
+class Snapshot(NamedTuple):
+    """Published state of the history: the frame and the statistics computed over exactly its rows"""
+    df: pd.DataFrame
+    stats: RunningStats
+    ranks: SortedIndex
+    cov: RunningCovariance
+    rollups: Dict[str, TimeRollup]
+    version: int
+    source: str = ""
+    flagged: int = 0  # Samples of df scored above ANOMALY_THRESHOLD
+
+    @property
+    def fingerprint(self):
+        """Identifies the data of this snapshot, e.g. as a key for caches of derived results"""
+        return self.source, self.version
+
+
+def new_rollups() -> Dict[str, TimeRollup]:
+    return {name: TimeRollup(freq, offset, LOCAL_TZ, Schema.TIMESTAMP) for name, (freq, offset) in ROLLUPS.items()}
+
+
+def load_data(source: Optional[str] = None) -> pd.DataFrame:
+    """
+    Read the whole history from the given source spec, or from the configured one
+    """
+    return TailLoader(open_source(source or configured_source())).refresh()
+
+
+def _column_values(series: pd.Series):
+    return series.to_numpy() if isinstance(series.dtype, np.dtype) else series.array
+
+
+def _allocate(values, capacity: int):
+    # Buffer di `capacity` righe che inizia con values; il resto non è mai esposto
+    if isinstance(values, np.ndarray):
+        buffer = np.empty(capacity, dtype=values.dtype)
+        buffer[:len(values)] = values
+        return buffer
+    return values.take(np.r_[np.arange(len(values)), np.full(capacity - len(values), -1)], allow_fill=True)
+
+
+class HistoryBuffer:
+    """
+    The history as preallocated column buffers (numpy arrays, or pandas arrays for datetimes and
+    categories): new rows are written after the used part and the published frame is made of
+    views on the first `rows` rows, so an append costs O(new rows), amortized over the geometric
+    growth, instead of copying the whole history. Published frames stay valid, since later rows
+    only go past their end and growing moves the buffers to new memory.
+    """
+
+    def __init__(self):
+        self.buffers: Dict[str, object] = {}
+        self.rows = 0
+        self.capacity = 0
+        self.frame = pd.DataFrame()
+
+    def append(self, new_rows: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add the rows and return the frame of the whole history
+        """
+        # Timestamps in nanoseconds: pandas infers [us] for whole seconds and [ns] for fractions, and a
+        # batch in another unit would not fit the buffers
+        units = {col: new_rows[col].dt.as_unit("ns") for col, dtype in new_rows.dtypes.items()
+                 if dtype.kind == "M" and new_rows[col].dt.unit != "ns"}
+        if units:
+            new_rows = new_rows.assign(**units)
+        if not self._fits(new_rows):
+            # Prima volta, o colonne e dtype cambiati: una concat, poi si riparte dai buffer
+            combined = pd.concat([self.frame, new_rows], ignore_index=True) if self.buffers else new_rows
+            self.rows, self.capacity = len(combined), int(len(combined) * HISTORY_GROWTH)
+            self.buffers = {col: _allocate(_column_values(combined[col]), self.capacity) for col in combined.columns}
+        else:
+            end = self.rows + len(new_rows)
+            if end > self.capacity:
+                self.capacity = max(end, int(self.capacity * HISTORY_GROWTH))
+                self.buffers = {col: _allocate(buffer[:self.rows], self.capacity)
+                                for col, buffer in self.buffers.items()}
+            for col, buffer in self.buffers.items():
+                buffer[self.rows:end] = _column_values(new_rows[col])
+            self.rows = end
+        self.frame = pd.DataFrame({col: buffer[:self.rows] for col, buffer in self.buffers.items()},
+                                  index=pd.RangeIndex(self.rows), copy=False)
+        return self.frame
+
+    def _fits(self, new_rows: pd.DataFrame) -> bool:
+        return bool(self.buffers) and list(new_rows.columns) == list(self.buffers) and \
+            all(new_rows[col].dtype == self.frame[col].dtype for col in self.buffers)
+
+
+class TailLoader:
+    """
+    Keep the parsed history of a source and append only the rows written since the previous
+    refresh, asking the source for the rows after the last seen id. Running statistics, the
+    sorted index used for percentile ranks, the covariance accumulator and the time rollups are
+    updated with the same new rows.
+    """
+
+    def __init__(self, source, transform: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None):
+        self.source = open_source(source) if isinstance(source, str) else source
+        self.transform = transform
+        self.history = HistoryBuffer()
+        self.df = self.history.frame
+        self.stats = RunningStats()
+        self.ranks = SortedIndex()
+        self.cov = RunningCovariance()
+        self.rollups = new_rollups()
+        self.last_id = None
+        self.flagged = 0  # Running count of the rows scored above ANOMALY_THRESHOLD
+
+    def refresh(self) -> pd.DataFrame:
+        """
+        Fetch the rows appended to the source and return the updated history
+        """
+        source = repr(self.source)
+        with METRICS.span("fetch", source=source):
+            batch = self.source.rows_since(self.last_id)
+        # Nothing to add (a source still empty, or reset to empty again): same frame, no new version
+        if batch.rows.empty and self.df.empty and set(batch.rows.columns) <= set(self.df.columns):
+            return self.df
+        if batch.reset:
+            self.history = HistoryBuffer()
+            self.df = self.history.frame
+            self.stats = RunningStats()
+            self.ranks = SortedIndex()
+            self.cov = RunningCovariance()
+            self.rollups = new_rollups()
+            self.last_id = None
+            self.flagged = 0
+        if batch.rows.empty and not (batch.reset or self.df.empty):
+            return self.df
+        with METRICS.span("append", source=source):
+            self._append(batch.rows)
+        METRICS.count("rows_loaded", len(batch.rows), source=source)
+        return self.df
+
+    def _append(self, new_rows: pd.DataFrame):
+        # Checked as read, then cast to the compact dtypes (SQLite and older Arrow stores do not parse with the schema)
+        new_rows = Schema.rename(new_rows)
+        problems = Schema.validate(new_rows)
+        if problems:
+            warnings.warn(f"{self.source!r}: " + "; ".join(problems))
+        new_rows = Schema.coerce(new_rows)
+
+        # Continue the index of the existing history so transforms can number the rows
+        new_rows.index = pd.RangeIndex(len(self.df), len(self.df) + len(new_rows))
+        if self.transform is not None:
+            new_rows = self.transform(new_rows)
+        if 'id' in new_rows.columns and not new_rows.empty:
+            self.last_id = new_rows['id'].iloc[-1]
+
+        # New rows are scored against the history before them; the first batch against itself
+        has_baseline = bool(self.ranks.values)
+        if has_baseline:
+            scores = self._score(new_rows)
+        self.stats.update(new_rows)
+        self.ranks.update(new_rows)
+        self.cov.update(new_rows)
+        for rollup in self.rollups.values():
+            rollup.update(new_rows)
+        if not has_baseline:
+            scores = self._score(new_rows)
+        if scores:
+            self.flagged += count_flagged(scores[Schema.ANOMALY_SCORE], ANOMALY_THRESHOLD)
+        # Added after the accumulators, which must not see the derived columns
+        new_rows = new_rows.assign(**scores)
+        self.df = self.history.append(new_rows)
+
+    def _score(self, rows: pd.DataFrame) -> Dict[str, object]:
+        """
+        Anomaly score of each row: the largest absolute robust z-score over the sensor columns,
+        scaled for the number of columns compared, with the column it comes from, computed for
+        the whole batch at once
+        """
+        columns = [col for col in Schema.COLUMN_SCHEMA if col != 'id' and col in rows.columns]
+        if not columns or rows.empty:
+            return {}
+        with np.errstate(invalid="ignore"):
+            z = robust_zscores(rows[columns].to_numpy(), columns, self.ranks, self.stats, ANOMALY_MIN_SCALE)
+        # Columns piled up on a schema bound (particle counters that are mostly 0, dom_pct saturated
+        # at 100), i.e. with a quartile on the bound, have no spread to compare with: skipped
+        saturated = [i for i, col in enumerate(columns) if self._saturated(col)]
+        z[:, saturated] = np.nan
+        np.abs(z, out=z)
+        np.nan_to_num(z, copy=False, nan=-1.0)  # Unscored columns never win the argmax
+        top = z.argmax(axis=1)
+        # Scaled so that ANOMALY_THRESHOLD keeps its single-metric false alarm rate for the max over all columns
+        scale = ANOMALY_THRESHOLD / family_threshold(ANOMALY_THRESHOLD, len(columns) - len(saturated))
+        scores = (z[np.arange(len(rows)), top] * scale).astype(np.float32)
+        codes = np.where(scores >= 0, top, -1)
+        scores[codes < 0] = np.nan
+        return {
+            Schema.ANOMALY_SCORE: scores,
+            Schema.ANOMALY_METRIC: pd.Categorical.from_codes(codes, categories=columns),
+        }
+
+    def _saturated(self, column: str) -> bool:
+        _, low, high = Schema.COLUMN_SCHEMA[column]
+        return (low is not None and self.ranks.quantile(column, 0.25) <= low) or \
+            (high is not None and self.ranks.quantile(column, 0.75) >= high)
+
+
+class FileWatcher:
+    """
+    Calls back as soon as a local source changes on disk (inotify and friends, through watchdog),
+    so new rows are read immediately instead of at the next poll. Does nothing without watchdog.
+    """
+
+    EVENTS = ("created", "modified", "moved", "deleted")
+
+    def __init__(self, path: str, callback: Callable[[], None]):
+        self.path = os.path.abspath(path)
+        self.callback = callback
+        self.observer = None
+
+    def start(self) -> "FileWatcher":
+        if Observer is not None and self.observer is None:
+            # A file is watched through its directory, also catching rewrites and SQLite -wal files
+            directory = self.path if os.path.isdir(self.path) else os.path.dirname(self.path)
+            self.observer = Observer()
+            self.observer.daemon = True
+            self.observer.schedule(self, directory, recursive=False)
+            self.observer.start()
+        return self
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer = None
+
+    def dispatch(self, event):
+        # Reads of the source itself produce opened/closed events, which must not wake the poller
+        if event.event_type not in self.EVENTS:
+            return
+        paths = (event.src_path, getattr(event, "dest_path", "") or "")
+        if any(os.fsdecode(path).startswith(self.path) for path in paths):
+            self.callback()
+
+
+def watch_source(source, callback: Callable[[], None]) -> Optional[FileWatcher]:
+    """
+    Start a FileWatcher on the file or store behind a local source; None for remote sources
+    """
+    if isinstance(source, HttpCsvSource):
+        return None
+    if isinstance(source, (CsvFileSource, SQLiteSource)):
+        path = source.path
+    elif isinstance(source, ArrowSource):
+        path = source.store.directory
+        os.makedirs(path, exist_ok=True)
+    else:
+        return None
+    return FileWatcher(path, callback).start() if os.path.exists(path) else None
+
+
+class DataService:
+    """
+    Process-wide holder of the sample history. A background thread polls the loader once per
+    interval and every session reads the same snapshot, whose frame must be treated as read-only.
+    """
+
+    def __init__(self, loader: TailLoader, interval: float = POLL_INTERVAL):
+        self.loader = loader
+        self.interval = interval
+        # Snapshot.version is incremented every time new rows are appended
+        self.snapshot = Snapshot(pd.DataFrame(), RunningStats(), SortedIndex(), RunningCovariance(), new_rollups(), 0)
+        self.error = None
+        self.failures = 0
+        self.retry_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._watcher = None
+
+    def start(self) -> "DataService":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="coffee-data-service", daemon=True)
+            self._thread.start()
+            self._watcher = watch_source(self.loader.source, self.wake)
+            METRICS.register(self.gauges)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._watcher is not None:
+            self._watcher.stop()
+
+    def wake(self):
+        """
+        Poll now instead of at the end of the interval, e.g. when rows were pushed to the source
+        """
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def backoff(self) -> float:
+        """
+        Delay before the next attempt after consecutive failures: exponential in the number of
+        failures, capped at BACKOFF_MAX, with jitter so that sources failing together (e.g. a
+        fleet behind the same server) do not retry in lockstep
+        """
+        delay = min(BACKOFF_MAX, self.interval * 2 ** self.failures)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def poll(self):
+        """
+        Read the new rows from the source and publish the updated frame; after a failure the
+        source is left alone until the backoff delay has passed
+        """
+        if self.failures and time.monotonic() < self.retry_at:
+            return
+        with self._lock:
+            try:
+                df = self.loader.refresh()
+                self.error = None
+                self.failures = 0
+            except Exception as e:
+                self.error = e
+                self.failures += 1
+                METRICS.count("poll_errors", source=repr(self.loader.source), error=type(e).__name__)
+                self.retry_at = time.monotonic() + self.backoff()
+                return
+            finally:
+                # After the first attempt sessions are served from memory, retries are left to the thread
+                self._loaded = True
+            if df is not self.snapshot.df:
+                # One assignment, sessions never see a frame with the statistics of another one
+                self.snapshot = Snapshot(df, self.loader.stats.copy(), self.loader.ranks.copy(),
+                                         self.loader.cov.copy(),
+                                         {name: rollup.copy() for name, rollup in self.loader.rollups.items()},
+                                         self.snapshot.version + 1, repr(self.loader.source), self.loader.flagged)
+
+    def get(self) -> Snapshot:
+        """
+        Return the shared snapshot, loading it synchronously only on the very first request
+        """
+        if self._loaded:
+            self.hits += 1
+        else:
+            self.misses += 1
+            with self._lock:
+                pending = not self._loaded
+            if pending:
+                self.poll()
+        return self.snapshot
+
+    def counters(self) -> dict:
+        snapshot = self.snapshot
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'failures': self.failures,
+            'version': snapshot.version,
+            'rows': len(snapshot.df),
+        }
+
+    def gauges(self, **labels) -> list:
+        """
+        The counters as (name, labels, value) gauges for the metrics registry
+        """
+        labels = dict(labels, source=repr(self.loader.source))
+        return [(f"data_service_{name}", labels, value) for name, value in self.counters().items()]
+
+
+class FleetService:
+    """
+    Fleet mode: one DataService per machine, partitioned by machine id, all polled by a single
+    background thread through a shared pool of FLEET_WORKERS threads instead of one thread and
+    one process per machine.
+    """
+
+    def __init__(self, loaders: Dict[str, TailLoader], interval: float = POLL_INTERVAL,
+                 max_workers: int = FLEET_WORKERS):
+        self.interval = interval
+        self.services = {machine: DataService(loader, interval) for machine, loader in loaders.items()}
+        self._pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(loaders))),
+                                        thread_name_prefix="coffee-fleet")
+        self._stop = threading.Event()
+        self._thread = None
+        self._watchers = []
+
+    def start(self) -> "FleetService":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="coffee-fleet-service", daemon=True)
+            self._thread.start()
+            # A machine whose file changes is polled right away on the shared pool
+            for machine, service in self.services.items():
+                METRICS.register(lambda service=service, machine=machine: service.gauges(machine=machine))
+                watcher = watch_source(service.loader.source, lambda service=service: self._pool.submit(service.poll))
+                if watcher is not None:
+                    self._watchers.append(watcher)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for watcher in self._watchers:
+            watcher.stop()
+        self._pool.shutdown(wait=False)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll()
+            self._stop.wait(self.interval)
+
+    def poll(self):
+        """
+        Poll every machine concurrently, slow sources only hold one pool thread each
+        """
+        list(self._pool.map(DataService.poll, self.services.values()))
+
+    def machines(self) -> List[str]:
+        return list(self.services)
+
+    def get(self, machine: str) -> Snapshot:
+        return self.services[machine].get()
+
+    def overview(self, metrics: List[str]) -> pd.DataFrame:
+        """
+        One row per machine: sample count, latest value and running mean of each metric
+        """
+        rows = []
+        for machine, service in self.services.items():
+            snapshot = service.snapshot
+            row = {'Machine': machine, 'Samples': len(snapshot.df), 'Error': str(service.error or "")}
+            if not snapshot.df.empty:
+                latest = snapshot.df.iloc[-1]
+                means = snapshot.stats.mean(metrics)
+                for col in metrics:
+                    if col in snapshot.df.columns:
+                        row[col] = latest[col]
+                        row[f"{col} (avg)"] = means[col]
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def counters(self) -> dict:
+        return {machine: service.counters() for machine, service in self.services.items()}
+
+
+_sort_orders = OrderedDict()
+_sort_lock = threading.Lock()
+
+
+def _sort_order(df: pd.DataFrame, column: str, cache_key: Optional[Hashable]) -> np.ndarray:
+    # Argsort of a column, cached per data fingerprint so paging through a sorted view sorts once
+    key = (cache_key, column) if cache_key is not None else None
+    with _sort_lock:
+        if key in _sort_orders:
+            _sort_orders.move_to_end(key)
+            return _sort_orders[key]
+    values = df[column]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Per nome della categoria, i campioni senza valore (non ancora valutati) in fondo
+        codes = values.cat.codes.to_numpy()
+        names = np.argsort(np.argsort(values.cat.categories.astype(str)))
+        order = np.argsort(np.where(codes < 0, len(names), names[codes]), kind='stable')
+    elif values.dtype.kind in "biufmM":
+        order = np.argsort(values.to_numpy(), kind='stable')
+    else:
+        # Text or mixed values: let pandas order them, with the missing ones last
+        order = values.reset_index(drop=True).sort_values(kind='stable', na_position='last').index.to_numpy()
+    if key is not None:
+        with _sort_lock:
+            _sort_orders[key] = order
+            while len(_sort_orders) > SORT_CACHE_SIZE:
+                _sort_orders.popitem(last=False)
+    return order
+
+
+def query_window(df: pd.DataFrame, offset: int = 0, limit: int = 100, sort_by: Optional[str] = None,
+                 ascending: bool = True, id_range: Optional[Tuple[int, int]] = None,
+                 thresholds: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None,
+                 cache_key: Optional[Hashable] = None) -> Tuple[pd.DataFrame, int]:
+    """
+    One page of the history: rows [offset, offset + limit) after filtering by Sample ID range and
+    per-column thresholds and sorting by a column. Returns the page and the number of matching rows.
+    Pass the snapshot fingerprint as cache_key to reuse the sort order between pages.
+    """
+    mask = row_mask(df, id_range=id_range, thresholds=thresholds)
+    if sort_by is None:
+        if mask is None:
+            return df.iloc[offset:offset + limit], len(df)
+        positions = np.flatnonzero(mask)
+    else:
+        positions = _sort_order(df, sort_by, cache_key)
+        if not ascending:
+            positions = positions[::-1]
+        if mask is not None:
+            positions = positions[mask[positions]]
+    return df.iloc[positions[offset:offset + limit]], len(positions)
+
+
+def window_rows(df: pd.DataFrame, last_n: Optional[int] = None, hours: Optional[float] = None) -> pd.DataFrame:
+    """
+    Recent window of the history: the last N samples and/or the samples taken in the K hours up to
+    the latest one. The whole history when neither is given.
+    """
+    if last_n is not None:
+        df = df.iloc[-last_n:]
+    if hours is not None and has_timestamps(df):
+        times = df[Schema.TIMESTAMP]
+        df = df[(times >= times.iloc[-1] - pd.Timedelta(hours=hours)).to_numpy()]
+    return df
 
-# 📌 URL del file CSV su GitHub con timestamp per evitare cache
-def load_data():
-    timestamp = int(time.time())  # Cambia ogni secondo
-    csv_url = f"https://raw.githubusercontent.com/FabioDani2295/CoffeeController/main/CoffeStatistics.csv?{timestamp}"
-    return pd.read_csv(csv_url)
 
+def has_timestamps(df: pd.DataFrame) -> bool:
+    """
+    Whether the latest sample has a real acquisition time, enabling time windows and rollups
+    """
+    return Schema.TIMESTAMP in df.columns and not df.empty and pd.notna(df[Schema.TIMESTAMP].iloc[-1])
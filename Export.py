@@ -0,0 +1,105 @@
+import gzip
+import tempfile
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from Metrics import METRICS
+
+EXPORT_CHUNK_ROWS = 50_000  # Righe serializzate per volta
+SPOOL_MAX_BYTES = 32 * 1024 * 1024  # Oltre questa dimensione l'export passa su file temporaneo
+
+# 📌 Formati di export: etichetta -> (estensione, mime)
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "CSV (gzip)": ("csv.gz", "application/gzip"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+    "Arrow": ("arrow", "application/vnd.apache.arrow.file"),
+}
+
+
+def row_mask(df: pd.DataFrame, id_range: Optional[Tuple[int, int]] = None,
+             time_range: Optional[Tuple[pd.Timestamp, pd.Timestamp]] = None,
+             thresholds: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None) -> Optional[np.ndarray]:
+    """
+    Boolean mask of the rows within an inclusive Sample ID range, a time range (when the history
+    has timestamps) and per-column (min, max) thresholds; None when nothing is filtered
+    """
+    mask = None
+
+    def restrict(values, low, high):
+        nonlocal mask
+        keep = np.ones(len(values), dtype=bool)
+        if low is not None:
+            keep &= values >= low
+        if high is not None:
+            keep &= values <= high
+        mask = keep if mask is None else mask & keep
+
+    if id_range is not None and 'Sample ID' in df.columns:
+        restrict(df['Sample ID'].to_numpy(), *id_range)
+    if time_range is not None and 'timestamp' in df.columns:
+        restrict(df['timestamp'].to_numpy(), *(np.datetime64(t) for t in time_range))
+    for col, (low, high) in (thresholds or {}).items():
+        if col in df.columns and (low is not None or high is not None):
+            restrict(df[col].to_numpy(), low, high)
+    return mask
+
+
+def select_rows(df: pd.DataFrame, id_range: Optional[Tuple[int, int]] = None,
+                time_range: Optional[Tuple[pd.Timestamp, pd.Timestamp]] = None,
+                thresholds: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None) -> pd.DataFrame:
+    """
+    Rows passing the filters of row_mask
+    """
+    mask = row_mask(df, id_range, time_range, thresholds)
+    return df if mask is None or mask.all() else df[mask]
+
+
+def iter_csv(df: pd.DataFrame, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    """
+    CSV encoded chunk by chunk, header first, so no single string holds the whole history
+    """
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_csv(index=False, header=start == 0).encode('utf-8')
+
+
+def export_file(df: pd.DataFrame, fmt: str = "CSV", chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """
+    Write the rows in the requested format to a spooled temporary file (in memory up to
+    SPOOL_MAX_BYTES) and return it rewound, ready to be streamed to the client
+    """
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    if fmt == "CSV":
+        for chunk in iter_csv(df, chunk_rows):
+            out.write(chunk)
+    elif fmt == "CSV (gzip)":
+        with gzip.GzipFile(fileobj=out, mode='wb', mtime=0) as gz:
+            for chunk in iter_csv(df, chunk_rows):
+                gz.write(chunk)
+    elif fmt in ("Parquet", "Arrow"):
+        table = pa.Table.from_pandas(df.iloc[:0], preserve_index=False)
+        sink = pa.PythonFile(out, mode='w')
+        writer = pq.ParquetWriter(sink, table.schema, compression='zstd') if fmt == "Parquet" \
+            else pa.ipc.new_file(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+        with writer:
+            for start in range(0, len(df), chunk_rows):
+                writer.write_table(pa.Table.from_pandas(df.iloc[start:start + chunk_rows], schema=table.schema,
+                                                        preserve_index=False))
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+    out.seek(0)
+    return out
+
+
+def export_bytes(df: pd.DataFrame, fmt: str = "CSV") -> bytes:
+    """
+    Whole export as bytes, for st.download_button callables (which accept bytes or BytesIO, not spooled files)
+    """
+    with METRICS.span("export", format=fmt), export_file(df, fmt) as f:
+        data = f.read()
+    METRICS.count("export_bytes", len(data), format=fmt)
+    return data
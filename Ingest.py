@@ -0,0 +1,168 @@
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional, Tuple
+
+import pandas as pd
+
+import Schema
+from Storage import ArrowStore
+
+# 📌 API di ingestione locale: il rig invia i campioni direttamente, senza passare da GitHub
+INGEST_HOST = "127.0.0.1"
+INGEST_PORT = 8765
+INGEST_STORE = "samples.arrow"
+MAX_BODY_BYTES = 16 * 1024 * 1024  # Dimensione massima di un batch
+
+
+class Ingestor:
+    """
+    Validates batches of sample rows against the schema, numbers them after the last stored id,
+    appends them to an ArrowStore as one segment per batch and notifies the subscribers
+    (e.g. DataService.wake) so the new rows are read right away instead of at the next poll.
+    """
+
+    def __init__(self, store: ArrowStore):
+        self.store = store
+        self.listeners: List[Callable[[], None]] = []
+        self.batches = 0
+        self.rows = 0
+        self._lock = threading.Lock()
+        self.last_id = self._stored_last_id()
+
+    def __repr__(self):
+        return f"Ingestor({self.store.directory!r})"
+
+    def _stored_last_id(self) -> int:
+        # Ids are increasing, the last segment holds the largest one
+        table, _ = self.store.read(skip=max(len(self.store.segments()) - 1, 0))
+        if table is None:
+            return 0
+        return int(table.column('id').to_numpy().max()) if 'id' in table.column_names and table.num_rows else 0
+
+    def subscribe(self, callback: Callable[[], None]):
+        self.listeners.append(callback)
+
+    def ingest(self, rows: pd.DataFrame) -> Tuple[int, int]:
+        """
+        Store a batch and return its (first id, last id). Rows without an id are numbered after
+        the last stored one; given ids must be increasing. Rows without a timestamp are stamped
+        with the time of arrival. Raises SchemaError for invalid rows.
+        """
+        if rows.empty:
+            raise Schema.SchemaError("empty batch")
+        with self._lock:
+            if 'id' not in rows.columns:
+                rows = rows.assign(id=range(self.last_id + 1, self.last_id + 1 + len(rows)))
+                rows = rows[['id'] + [col for col in rows.columns if col != 'id']]
+            if Schema.TIMESTAMP not in rows.columns:
+                # The rig did not stamp the samples: use the time they were received
+                rows = rows.assign(**{Schema.TIMESTAMP: pd.Timestamp.now(tz="UTC")})
+            rows = Schema.check(rows.reset_index(drop=True), required=True)
+            ids = rows['id'].to_numpy()
+            if ids[0] <= self.last_id or (len(ids) > 1 and (ids[1:] <= ids[:-1]).any()):
+                raise Schema.SchemaError(f"ids must be increasing and greater than {self.last_id}")
+            self.store.append(rows)
+            self.last_id = int(ids[-1])
+            self.batches += 1
+            self.rows += len(rows)
+        for callback in self.listeners:
+            callback()
+        return int(ids[0]), int(ids[-1])
+
+
+def parse_rows(body: bytes, content_type: str = "") -> pd.DataFrame:
+    """
+    Rows of a request body: CSV with a header line (text/csv), or JSON as a list of records
+    or {"rows": [...]}. Source (mean_H) and display (Mean_H) column names are both accepted.
+    """
+    if "csv" in content_type:
+        return pd.read_csv(io.BytesIO(body))
+    payload = json.loads(body or b"null")
+    if isinstance(payload, dict):
+        payload = payload.get("rows")
+    if not isinstance(payload, list) or not all(isinstance(row, dict) for row in payload):
+        raise ValueError('expected a list of row objects or {"rows": [...]}')
+    return pd.DataFrame.from_records(payload)
+
+
+class IngestHandler(BaseHTTPRequestHandler):
+    """POST /samples stores a batch, GET /health reports the ingestion counters"""
+
+    protocol_version = "HTTP/1.1"
+    server: "IngestServer"
+
+    def do_POST(self):
+        if self.path.split("?")[0] != "/samples":
+            return self._reply(404, {"error": "not found"})
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            return self._reply(413, {"error": f"batch larger than {MAX_BODY_BYTES} bytes"})
+        try:
+            rows = parse_rows(self.rfile.read(length), self.headers.get("Content-Type", ""))
+            first_id, last_id = self.server.ingestor.ingest(rows)
+        except (ValueError, TypeError, KeyError, pd.errors.ParserError) as e:
+            # SchemaError is a ValueError; TypeError covers values pandas cannot build a frame from
+            return self._reply(400, {"error": str(e)})
+        self._reply(200, {"accepted": last_id - first_id + 1, "first_id": first_id, "last_id": last_id})
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/health":
+            return self._reply(404, {"error": "not found"})
+        ingestor = self.server.ingestor
+        self._reply(200, {"last_id": ingestor.last_id, "batches": ingestor.batches, "rows": ingestor.rows})
+
+    def _reply(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class IngestServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, ingestor: Ingestor, host: str = INGEST_HOST, port: int = INGEST_PORT):
+        super().__init__((host, port), IngestHandler)
+        self.ingestor = ingestor
+
+
+def start_server(ingestor: Ingestor, host: str = INGEST_HOST, port: int = INGEST_PORT) -> IngestServer:
+    """
+    Serve the ingestion API from a daemon thread, e.g. inside the dashboard process
+    """
+    server = IngestServer(ingestor, host, port)
+    threading.Thread(target=server.serve_forever, name="coffee-ingest", daemon=True).start()
+    return server
+
+
+def configured_ingest_port(argv=None) -> Optional[int]:
+    """
+    Port of the in-process ingestion API (--ingest PORT or COFFEE_INGEST), None when disabled
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--ingest", type=int, default=os.environ.get("COFFEE_INGEST") or None)
+    args, _ = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+    return args.ingest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local ingestion API appending sample rows to an Arrow store")
+    parser.add_argument("--store", default=INGEST_STORE, help=f"Store directory (default: {INGEST_STORE})")
+    parser.add_argument("--host", default=INGEST_HOST)
+    parser.add_argument("--port", type=int, default=INGEST_PORT)
+    args = parser.parse_args()
+
+    server = IngestServer(Ingestor(ArrowStore(args.store)), args.host, args.port)
+    print(f"Ingesting into {args.store} on http://{args.host}:{args.port}/samples")
+    server.serve_forever()
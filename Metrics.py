@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+METRICS_PREFIX = "coffee"
+METRICS_HOST = "127.0.0.1"
+JSON_LOG_INTERVAL = 15  # Secondi tra due righe del log JSON
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+class Timing:
+    """Count, total, max and last duration of a span, in seconds"""
+    __slots__ = ("count", "total", "max", "last")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+
+class Metrics:
+    """
+    Process-wide registry of timing spans, counters and gauges. Recording is a dict update under
+    a lock, cheap enough for the hot paths; gauges are read from the registered collectors only
+    when the metrics are exported.
+    """
+
+    def __init__(self):
+        self.timings: Dict[Tuple[str, Labels], Timing] = {}
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.collectors: List[Callable[[], List[Sample]]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        """
+        Time the enclosed block, e.g. `with METRICS.span("render", section="history"):`
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                timing = self.timings[key] = Timing()
+            timing.count += 1
+            timing.total += seconds
+            timing.max = max(timing.max, seconds)
+            timing.last = seconds
+
+    def laps(self, name: str, label: str = "section") -> Callable[[str], None]:
+        """
+        Callable timing consecutive parts of a long block: each call records the time since the
+        previous one (or since creation) under name, e.g. `lap("overview")` -> name{section="overview"}
+        """
+        last = time.perf_counter()
+
+        def lap(value: str):
+            nonlocal last
+            now = time.perf_counter()
+            self.observe(name, now - last, **{label: value})
+            last = now
+
+        return lap
+
+    def count(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def register(self, collector: Callable[[], List[Sample]]):
+        """
+        Add a callable returning (name, labels, value) gauges, e.g. cache hit counters kept elsewhere
+        """
+        self.collectors.append(collector)
+
+    def gauges(self) -> List[Sample]:
+        samples = process_memory()
+        for collector in list(self.collectors):
+            samples.extend(collector())
+        return samples
+
+    def snapshot(self) -> dict:
+        """
+        All metrics as plain data, for the JSON log and the Diagnostics panel
+        """
+        with self._lock:
+            timings = [dict(name=name, labels=dict(labels), count=t.count, total=t.total, max=t.max, last=t.last)
+                       for (name, labels), t in self.timings.items()]
+            counters = [dict(name=name, labels=dict(labels), value=value)
+                        for (name, labels), value in self.counters.items()]
+        gauges = [dict(name=name, labels=labels, value=value) for name, labels, value in self.gauges()]
+        return {'time': time.time(), 'timings': timings, 'counters': counters, 'gauges': gauges}
+
+    def prometheus(self) -> str:
+        """
+        Metrics in the Prometheus text exposition format: spans as summaries (_count, _sum) plus
+        a _max gauge, counters as _total, gauges as they are
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def family(name: str, kind: str, samples: List[Tuple[str, dict, float]]):
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{sample}{_format_labels(labels)} {value!r}" for sample, labels, value in samples)
+
+        by_name: Dict[str, list] = {}
+        for timing in snapshot['timings']:
+            by_name.setdefault(timing['name'], []).append(timing)
+        for name, timings in sorted(by_name.items()):
+            metric = f"{METRICS_PREFIX}_{name}_seconds"
+            family(metric, "summary",
+                   [(f"{metric}_count", t['labels'], float(t['count'])) for t in timings]
+                   + [(f"{metric}_sum", t['labels'], t['total']) for t in timings])
+            family(f"{metric}_max", "gauge", [(f"{metric}_max", t['labels'], t['max']) for t in timings])
+
+        families = (("counter", snapshot['counters'], "_total"), ("gauge", snapshot['gauges'], ""))
+        for kind, entries, suffix in families:
+            by_name = {}
+            for entry in entries:
+                by_name.setdefault(entry['name'], []).append(entry)
+            for name, samples in sorted(by_name.items()):
+                metric = f"{METRICS_PREFIX}_{name}{suffix}"
+                family(metric, kind, [(metric, s['labels'], float(s['value'])) for s in samples])
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: str):
+        """
+        Append one JSON line with the current metrics
+        """
+        with open(path, 'a') as f:
+            f.write(json.dumps(self.snapshot()) + "\n")
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in sorted(labels.items())) + "}"
+
+
+def peak_resident_bytes() -> float:
+    """
+    Peak resident memory of the process: ru_maxrss is in bytes on macOS, in KiB on Linux
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return float(peak if sys.platform == "darwin" else peak * 1024)
+
+
+def process_memory() -> List[Sample]:
+    """
+    Resident and peak memory of the process (current RSS from /proc where available)
+    """
+    samples = [("process_peak_resident_bytes", {}, peak_resident_bytes())]
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        samples.append(("process_resident_bytes", {}, float(resident_pages * os.sysconf("SC_PAGE_SIZE"))))
+    except (OSError, ValueError, IndexError):
+        pass
+    return samples
+
+
+METRICS = Metrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics in the Prometheus text format, GET /metrics.json as JSON"""
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            body, content_type = METRICS.prometheus().encode(), "text/plain; version=0.0.4"
+        elif path == "/metrics.json":
+            body, content_type = json.dumps(METRICS.snapshot()).encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_exporter(port: int, host: str = METRICS_HOST) -> ThreadingHTTPServer:
+    """
+    Serve /metrics for a local collector from a daemon thread
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="coffee-metrics", daemon=True).start()
+    return server
+
+
+def start_json_log(path: str, interval: float = JSON_LOG_INTERVAL) -> threading.Thread:
+    """
+    Append the metrics to a JSON lines file every interval seconds, from a daemon thread
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                METRICS.write_json(path)
+            except OSError:
+                pass
+
+    thread = threading.Thread(target=run, name="coffee-metrics-log", daemon=True)
+    thread.start()
+    return thread
+
+
+def configured_exports(argv=None) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Metrics export settings: --metrics-port PORT / COFFEE_METRICS_PORT for a Prometheus endpoint,
+    --metrics-log PATH / COFFEE_METRICS_LOG for a JSON lines log; None when disabled
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--metrics-port", type=int, default=os.environ.get("COFFEE_METRICS_PORT") or None)
+    parser.add_argument("--metrics-log", default=os.environ.get("COFFEE_METRICS_LOG") or None)
+    args, _ = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+    return args.metrics_port, args.metrics_log
@@ -0,0 +1,360 @@
+import argparse
+import html
+import json
+import math
+import os
+import sys
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import Schema
+from Analytics import (ColumnSummary, RadarAxes, card_deltas, color_summary, percentile_ranks, pm_summary, radar_axes,
+                       temperature_summary)
+from Charts import correlation_heatmap, history_chart, percentile_chart, radar_chart
+from Data import LOCAL_TZ
+from Sources import READ_CHUNK_ROWS, configured_fleet, configured_source, read_chunks
+from Stats import RunningCovariance, RunningStats, SortedIndex, TimeRollup
+
+# 📌 Report statici per audit QA: un report per macchina e giorno, senza avviare la dashboard
+REPORT_FORMATS = ("html", "json", "png")
+REPORT_DIRECTORY = "reports"
+ALL_DAYS = "all"  # Gruppo unico per --by machine, o per campioni senza timestamp
+UNDATED = "undated"
+PNG_SCALE = 2  # Risoluzione dei PNG rispetto alla dimensione del grafico
+
+
+class GroupAccumulator:
+    """
+    Statistics of one (machine, day) group, fed chunk by chunk with the incremental accumulators of
+    the dashboard. Only the ranked key metrics keep their values (sorted, for the percentile ranks);
+    everything else is O(columns) per group, or O(hours) for the hourly rollup.
+    """
+
+    def __init__(self, machine: str, day: str):
+        self.machine = machine
+        self.day = day
+        self.stats = RunningStats()
+        self.ranks = SortedIndex()
+        self.cov = RunningCovariance()
+        self.hourly = TimeRollup("1h", "0h", LOCAL_TZ, Schema.TIMESTAMP)
+        self.latest: Optional[pd.Series] = None
+        self.first_time = None
+        self.last_time = None
+        self.samples = 0
+
+    def update(self, rows: pd.DataFrame):
+        self.stats.update(rows)
+        self.ranks.update(rows[[col for _, col, _ in Schema.KEY_METRICS if col in rows.columns]])
+        self.cov.update(rows)
+        self.samples += len(rows)
+        self.latest = rows.iloc[-1]
+        if Schema.TIMESTAMP in rows.columns:
+            self.hourly.update(rows)
+            times = rows[Schema.TIMESTAMP].dropna()
+            if len(times):
+                self.first_time = times.iloc[0] if self.first_time is None else min(self.first_time, times.iloc[0])
+                self.last_time = times.iloc[-1] if self.last_time is None else max(self.last_time, times.iloc[-1])
+
+    def result(self) -> dict:
+        """
+        The dashboard statistics of the group as plain data: the cards, radar axes and percentile ranks
+        of its latest sample against the rest of the group, the correlations and the summaries
+        """
+        metrics = [metric for metric in Schema.KEY_METRICS if metric[1] in self.stats.columns]
+        columns = [col for _, col, _ in metrics]
+        latest = self.latest[columns].to_numpy(dtype=np.float64)
+        baseline = self.stats.mean_without(self.latest[columns]).to_numpy() if self.samples > 1 else None
+        axes = radar_axes(columns, latest, latest if baseline is None else baseline,
+                          self.stats.min(columns).to_numpy(), self.stats.max(columns).to_numpy())
+        ranks = percentile_ranks([self.ranks.values.get(col, np.empty(0)) for col in columns], latest)
+        hourly = self.hourly.frame(columns) if len(self.hourly.keys) else pd.DataFrame()
+        summary = ColumnSummary(self.stats.mean().to_dict(), self.stats.min().to_dict(), self.stats.max().to_dict())
+        return {
+            'machine': self.machine,
+            'day': self.day,
+            'samples': self.samples,
+            'first': None if self.first_time is None else self.first_time.isoformat(),
+            'last': None if self.last_time is None else self.last_time.isoformat(),
+            'latest_id': _value(self.latest.get('id')),
+            'cards': [card._asdict() for card in card_deltas(latest, baseline, metrics)],
+            'radar': {'metrics': axes.metrics, 'latest': axes.latest.tolist(), 'baseline': axes.baseline.tolist()},
+            'percentile_ranks': dict(zip(columns, ranks.tolist())),
+            'correlation': {'columns': columns, 'matrix': self.cov.corr(columns).to_numpy().tolist()},
+            'temperature': temperature_summary(summary),
+            'particulate': pm_summary(summary),
+            'color': color_summary(summary),
+            'hourly': {'Time': [t.isoformat() for t in hourly['Time']],
+                       **{col: hourly[col].tolist() for col in columns}} if not hourly.empty else {},
+        }
+
+
+def _value(value):
+    if isinstance(value, (np.integer, np.floating)):
+        value = value.item()
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+def _clean(data):
+    # JSON rigoroso: NaN diventa null
+    if isinstance(data, dict):
+        return {key: _clean(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [_clean(value) for value in data]
+    return _value(data)
+
+
+def day_keys(rows: pd.DataFrame) -> np.ndarray:
+    """
+    Local calendar day of every row, UNDATED for rows without a timestamp
+    """
+    if Schema.TIMESTAMP not in rows.columns:
+        return np.full(len(rows), UNDATED, dtype=object)
+    return rows[Schema.TIMESTAMP].dt.tz_convert(LOCAL_TZ).dt.strftime("%Y-%m-%d").fillna(UNDATED).to_numpy()
+
+
+def group_results(machines: Dict[str, str], by_day: bool = True, since: Optional[str] = None,
+                  until: Optional[str] = None, chunk_rows: int = READ_CHUNK_ROWS) -> Iterator[dict]:
+    """
+    Stream every machine's history once and fold each chunk into its (machine, day) groups; since and
+    until are inclusive local days (YYYY-MM-DD) and drop undated samples. Histories are in time
+    order, so a day is finished (its result yielded and its accumulator released) as soon as the
+    stream has moved past it; the other groups of a machine finish with its stream.
+    """
+    for machine, spec in machines.items():
+        groups: Dict[str, GroupAccumulator] = {}
+        finished = set()
+        for chunk in read_chunks(spec, chunk_rows):
+            days = day_keys(chunk)
+            keep = np.ones(len(chunk), dtype=bool)
+            if since:
+                keep &= (days != UNDATED) & (days >= since)
+            if until:
+                keep &= (days != UNDATED) & (days <= until)
+            if not keep.all():
+                chunk, days = chunk[keep], days[keep]
+            if chunk.empty:
+                continue
+            if not by_day:
+                days = np.full(len(chunk), ALL_DAYS, dtype=object)
+            for day, rows in chunk.groupby(days, sort=False):
+                if day in finished:
+                    warnings.warn(f"{machine}: {len(rows)} samples of {day} after its report was written "
+                                  f"(history not in time order), skipped")
+                    continue
+                if day not in groups:
+                    groups[day] = GroupAccumulator(machine, day)
+                groups[day].update(rows)
+            dated = days[days != UNDATED]
+            if by_day and len(dated):
+                first = dated.min()
+                for day in [day for day in groups if day != UNDATED and day < first]:
+                    finished.add(day)
+                    yield groups.pop(day).result()
+        for day in sorted(groups):
+            yield groups.pop(day).result()
+
+
+def figures(result: dict) -> Dict[str, object]:
+    """
+    The dashboard charts of a group result, in the dark theme of the dashboard
+    """
+    charts = {}
+    radar = result['radar']
+    if len(radar['metrics']) > 0 and result['samples'] > 1:
+        charts['radar'] = radar_chart(RadarAxes(radar['metrics'], np.array(radar['latest'], dtype=np.float64),
+                                                np.array(radar['baseline'], dtype=np.float64)), "Day average")
+    if result['percentile_ranks']:
+        charts['percentile'] = percentile_chart(result['percentile_ranks'])
+    correlation = result['correlation']
+    if len(correlation['columns']) >= 2:
+        charts['correlation'] = correlation_heatmap(pd.DataFrame(np.array(correlation['matrix'], dtype=np.float64),
+                                                                 index=correlation['columns'],
+                                                                 columns=correlation['columns']))
+    if result['hourly']:
+        hourly = pd.DataFrame(result['hourly'])
+        hourly['Time'] = pd.to_datetime(hourly['Time'])
+        metrics = [col for col in hourly.columns if col != 'Time']
+        charts['hourly'] = history_chart(hourly, metrics, x="Time", height=360)
+    for fig in charts.values():
+        fig.update_layout(template="plotly_dark")
+    return charts
+
+
+def report_stem(result: dict) -> str:
+    machine = "".join(c if c.isalnum() or c in "-_." else "_" for c in result['machine'])
+    return os.path.join(machine, result['day'])
+
+
+def render_group(result: dict, directory: str, formats: Iterable[str]) -> List[str]:
+    """
+    Write the report files of one group; runs in the worker processes, so it only takes plain data
+    """
+    stem = os.path.join(directory, report_stem(result))
+    os.makedirs(os.path.dirname(stem), exist_ok=True)
+    written = []
+    if "json" in formats:
+        with open(stem + ".json", 'w') as f:
+            json.dump(_clean(result), f, indent=2)
+        written.append(stem + ".json")
+    if not ({"html", "png"} & set(formats)):
+        return written
+
+    charts = figures(result)
+    if "png" in formats:
+        for name, fig in charts.items():
+            fig.write_image(f"{stem}-{name}.png", scale=PNG_SCALE)
+            written.append(f"{stem}-{name}.png")
+    if "html" in formats:
+        with open(stem + ".html", 'w') as f:
+            f.write(group_html(result, charts))
+        written.append(stem + ".html")
+    return written
+
+
+PAGE_STYLE = """
+body { background-color: #1E1E1E; color: white; font-family: sans-serif; margin: 2rem; }
+table { border-collapse: collapse; margin: 0.5rem 0 1.5rem; }
+td, th { border: 1px solid #444; padding: 4px 10px; text-align: right; }
+th { background-color: #333; }
+a { color: #87cefa; }
+.up { color: #28a745; } .down { color: #ff4b4b; }
+"""
+
+
+def _table(rows: List[dict]) -> str:
+    if not rows:
+        return "<p>Not available</p>"
+    head = "".join(f"<th>{html.escape(str(key))}</th>" for key in rows[0])
+    body = "".join("<tr>" + "".join(f"<td>{_cell(value)}</td>" for value in row.values()) + "</tr>" for row in rows)
+    return f"<table><tr>{head}</tr>{body}</table>"
+
+
+def _cell(value) -> str:
+    value = _value(value)
+    if value is None:
+        return "–"
+    return f"{value:.2f}" if isinstance(value, float) else html.escape(str(value))
+
+
+def group_html(result: dict, charts: Dict[str, object]) -> str:
+    """
+    Self-contained page of a group report; plotly.js is loaded once from the CDN
+    """
+    cards = "".join(
+        f'<tr><th>{html.escape(card["label"])}</th><td>{_cell(card["value"])}{card["unit"]}</td>'
+        f'<td>{_cell(card["baseline"])}{card["unit"]}</td>'
+        f'<td class="{"down" if card["delta"] < 0 else "up"}">'
+        f'{"–" if math.isnan(card["delta"]) else format(card["delta"], "+.2f") + card["unit"]}</td></tr>'
+        for card in result['cards'])
+    summaries = "".join(f"<h3>{title}</h3>" + _table([{'Statistic': key, 'Value': value}
+                                                      for key, value in result[name].items()])
+                        for title, name in (("Temperature", 'temperature'), ("Particulate", 'particulate'),
+                                            ("Color", 'color')))
+    plots = "".join(fig.to_html(full_html=False, include_plotlyjs="cdn" if i == 0 else False)
+                    for i, fig in enumerate(charts.values()))
+    period = f"{result['first'] or '–'} → {result['last'] or '–'}"
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>☕ {html.escape(result['machine'])} {result['day']}</title>
+<style>{PAGE_STYLE}</style></head>
+<body>
+<h1>☕ {html.escape(result['machine'])}: {result['day']}</h1>
+<p>{result['samples']} samples, {html.escape(period)}; latest sample #{_cell(result['latest_id'])}</p>
+<h2>Latest sample vs day average</h2>
+<table><tr><th>Metric</th><th>Latest</th><th>Average</th><th>Delta</th></tr>{cards}</table>
+<h2>Summaries</h2>
+{summaries}
+<h2>Charts</h2>
+{plots}
+</body></html>
+"""
+
+
+def index_html(entries: List[dict]) -> str:
+    rows = "".join(
+        f"<tr><td>{html.escape(e['machine'])}</td><td>{e['day']}</td><td>{e['samples']}</td><td>"
+        + " ".join(f'<a href="{html.escape(path)}">{os.path.splitext(path)[1][1:] or path}</a>'
+                   for path in e['files'] if not path.endswith(".png"))
+        + "</td></tr>" for e in entries)
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>☕ Coffee reports</title><style>{PAGE_STYLE}</style></head>
+<body><h1>☕ Coffee reports</h1>
+<table><tr><th>Machine</th><th>Day</th><th>Samples</th><th>Report</th></tr>{rows}</table>
+</body></html>
+"""
+
+
+def write_reports(results: Iterable[dict], directory: str, formats: Iterable[str], workers: int = 0) -> List[dict]:
+    """
+    Render every group as its result arrives, in a process pool when workers > 0 (charts are the
+    slow part, and they overlap with reading the rest of the history), then write the index pages;
+    returns one index entry per group
+    """
+    formats = tuple(formats)
+    entries = []
+
+    def entry(result: dict, files: List[str]) -> dict:
+        return {'machine': result['machine'], 'day': result['day'], 'samples': result['samples'],
+                'files': [os.path.relpath(path, directory) for path in files]}
+
+    if workers > 0:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for result in results:
+                futures[pool.submit(render_group, result, directory, formats)] = \
+                    {key: result[key] for key in ('machine', 'day', 'samples')}
+            for done, future in enumerate(as_completed(futures), 1):
+                entries.append(entry(futures[future], future.result()))
+                print(f"\r{done}/{len(futures)} reports", end="", file=sys.stderr)
+        print(file=sys.stderr)
+    else:
+        entries = [entry(result, render_group(result, directory, formats)) for result in results]
+    entries.sort(key=lambda e: (e['machine'], e['day']))
+    if "json" in formats:
+        with open(os.path.join(directory, "index.json"), 'w') as f:
+            json.dump(entries, f, indent=2)
+    if "html" in formats:
+        with open(os.path.join(directory, "index.html"), 'w') as f:
+            f.write(index_html(entries))
+    return entries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write static per-machine, per-day reports of the sample history")
+    parser.add_argument("--source", help="Source spec of a single machine (default: COFFEE_SOURCE or GitHub)")
+    parser.add_argument("--fleet", help="Machines to report on, as for the dashboard fleet mode")
+    parser.add_argument("-o", "--output", default=REPORT_DIRECTORY, help="Directory for the reports")
+    parser.add_argument("--format", nargs="+", choices=REPORT_FORMATS, default=["html", "json"], dest="formats")
+    parser.add_argument("--by", choices=["day", "machine"], default="day",
+                        help="One report per machine and day, or one per machine")
+    parser.add_argument("--since", help="First local day to include (YYYY-MM-DD)")
+    parser.add_argument("--until", help="Last local day to include (YYYY-MM-DD)")
+    parser.add_argument("--chunk-rows", type=int, default=READ_CHUNK_ROWS, help="Rows read per chunk")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes rendering the charts (0 renders in this process)")
+    args = parser.parse_args()
+
+    if "png" in args.formats:
+        try:
+            import kaleido  # noqa: F401 (used by plotly to export PNG)
+        except ImportError:
+            parser.error("PNG reports need the kaleido package (pip install kaleido)")
+
+    argv = sys.argv[1:]
+    machines = configured_fleet(argv)
+    if not machines:
+        spec = configured_source(argv)
+        machines = {os.path.splitext(os.path.basename(spec.rstrip("/")))[0] or "machine": spec}
+
+    start = time.perf_counter()
+    os.makedirs(args.output, exist_ok=True)
+    results = group_results(machines, by_day=args.by == "day", since=args.since, until=args.until,
+                            chunk_rows=args.chunk_rows)
+    entries = write_reports(results, args.output, args.formats, args.workers)
+    print(f"{sum(e['samples'] for e in entries)} samples in {len(entries)} groups: wrote "
+          f"{sum(len(e['files']) for e in entries)} files to {args.output} in {time.perf_counter() - start:.1f}s",
+          file=sys.stderr)
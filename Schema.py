@@ -0,0 +1,200 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# 📌 Nomi delle colonne di process_images -> nomi usati dalla dashboard
+DISPLAY_NAMES: Dict[str, str] = {
+    'mean_H': 'Mean_H',
+    'mean_S': 'Mean_S',
+    'mean_a': 'a*',
+    'mean_b': 'b*',
+    'dom_R': 'Mean_Red',
+    'dom_G': 'Mean_Green',
+    'dom_B': 'Mean_Blue',
+}
+SOURCE_NAMES: Dict[str, str] = {display: source for source, display in DISPLAY_NAMES.items()}
+
+# 📌 Schema dei campioni, per nome di visualizzazione: colonna -> (dtype, min, max)
+# The PM values and particle counters are averages over the sampling window (e.g. 589.2),
+# so they are stored as float32 rather than integers.
+COLUMN_SCHEMA: Dict[str, Tuple[str, Optional[float], Optional[float]]] = {
+    'id': ('uint32', 1, None),
+    # Temperature (termocamera)
+    'Max Temperature (°C)': ('float32', None, None),
+    'Min Temperature (°C)': ('float32', None, None),
+    'Mean Temperature (°C)': ('float32', None, None),
+    '% Pixels Above 40°C': ('float32', 0, 100),
+    # Particolato
+    'PM1_0_CU': ('float32', 0, None),
+    'PM2_5_CU': ('float32', 0, None),
+    'PM10_CU': ('float32', 0, None),
+    'PM1_0_CU_ae': ('float32', 0, None),
+    'PM2_5_CU_ae': ('float32', 0, None),
+    'PM10_CU_ae': ('float32', 0, None),
+    'particles_beyond_0_3': ('float32', 0, None),
+    'particles_beyond_0_5': ('float32', 0, None),
+    'particles_beyond_1_0': ('float32', 0, None),
+    'particles_beyond_2_5': ('float32', 0, None),
+    'particles_beyond_5_0': ('float32', 0, None),
+    'particles_beyond_10': ('float32', 0, None),
+    # Peso
+    'Min Weight': ('float32', None, None),
+    'Max Weight': ('float32', None, None),
+    'Weight Range': ('float32', 0, None),
+    'Average Weight': ('float32', None, None),
+    # Colore: HSV normalizzato, Lab e colore dominante RGB
+    'Mean_H': ('float32', 0, 1),
+    'Mean_S': ('float32', 0, 1),
+    'a*': ('float32', None, None),
+    'b*': ('float32', None, None),
+    'Mean_Red': ('float32', 0, 255),
+    'Mean_Green': ('float32', 0, 255),
+    'Mean_Blue': ('float32', 0, 255),
+    'dom_pct': ('float32', 0, 100),
+}
+
+# 📌 Istante di acquisizione del campione (ISO 8601, salvato in UTC); facoltativo
+TIMESTAMP = 'timestamp'
+
+# 📌 Colonne calcolate dalla dashboard: punteggio di anomalia e metrica che più si discosta
+ANOMALY_SCORE = 'Anomaly Score'
+ANOMALY_METRIC = 'Anomaly Metric'
+
+# 📌 Categorie della sidebar (colonne assenti dai dati vengono ignorate)
+COLUMN_CATEGORIES: Dict[str, List[str]] = {
+    "Temperature": ['Max Temperature (°C)', 'Min Temperature (°C)', 'Mean Temperature (°C)'],
+    "Particulate Matter": ['PM1_0_CU', 'PM2_5_CU', 'PM10_CU', 'PM1_0_CU_ae', 'PM2_5_CU_ae', 'PM10_CU_ae'],
+    "Particles": ['particles_beyond_0_3', 'particles_beyond_0_5', 'particles_beyond_1_0',
+                  'particles_beyond_2_5', 'particles_beyond_5_0', 'particles_beyond_10'],
+    "Color": ['Mean_Red', 'Mean_Green', 'Mean_Blue', 'Mean_H', 'Mean_S', 'a*', 'b*', 'Dist_White', 'Dist_Gray'],
+    "Weight": ['Min Weight', 'Max Weight', 'Weight Range', 'Average Weight'],
+}
+
+# 📌 Metriche chiave mostrate nelle card e nel grafico radar: (etichetta, colonna, unità)
+KEY_METRICS: List[Tuple[str, str, str]] = [
+    ("Max Temp", "Max Temperature (°C)", "°C"),
+    ("PM1.0", "PM1_0_CU", ""),
+    ("PM2.5", "PM2_5_CU", ""),
+    ("Avg Weight", "Average Weight", "g"),
+    ("Hue", "Mean_H", ""),
+    ("Saturation", "Mean_S", ""),
+]
+
+
+class SchemaError(ValueError):
+    """Raised when sample rows do not match COLUMN_SCHEMA"""
+
+
+def display_names(columns: Iterable[str]) -> List[str]:
+    """
+    Dashboard names for a list of source column names
+    """
+    return [DISPLAY_NAMES.get(col, col) for col in columns]
+
+
+def dtypes_for(columns: Iterable[str]) -> Dict[str, str]:
+    """
+    dtype mapping for pd.read_csv, restricted to the given (display) columns; unknown columns are inferred
+    """
+    return {col: COLUMN_SCHEMA[col][0] for col in columns if col in COLUMN_SCHEMA}
+
+
+def rename(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    The frame with display column names, unchanged when it already has them
+    """
+    if any(col in DISPLAY_NAMES for col in df.columns):
+        df = df.rename(columns=DISPLAY_NAMES)
+    return df
+
+
+def renamed_conflicts(columns: Iterable[str]) -> List[str]:
+    """
+    Columns that would share a display name after rename, e.g. both mean_a and a*
+    """
+    by_name: Dict[str, List[str]] = {}
+    for col in columns:
+        by_name.setdefault(DISPLAY_NAMES.get(col, col), []).append(str(col))
+    return [f"columns {' and '.join(cols)} are both {name}" for name, cols in by_name.items() if len(cols) > 1]
+
+
+def coerce(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Rename and cast an already parsed frame (SQLite, Arrow) to the display names and schema dtypes,
+    parsing the timestamp column when present
+    """
+    df = rename(df)
+    dtypes = {col: dtype for col, dtype in dtypes_for(df.columns).items() if df[col].dtype != dtype}
+    text = [col for col in dtypes if not pd.api.types.is_numeric_dtype(df[col].dtype)]
+    if text:
+        # Celle non numeriche (es. "ERR" scritto da un sensore, segnalate da validate) diventano NaN
+        df = df.assign(**{col: pd.to_numeric(df[col], errors="coerce") for col in text})
+    if dtypes:
+        df = df.astype(dtypes)
+    if TIMESTAMP in df.columns and not isinstance(df[TIMESTAMP].dtype, pd.DatetimeTZDtype):
+        # Timestamps without an offset are taken as UTC
+        df = df.assign(**{TIMESTAMP: pd.to_datetime(df[TIMESTAMP], utc=True, format="ISO8601")})
+    return df
+
+
+def validate(df: pd.DataFrame, required: bool = False) -> List[str]:
+    """
+    Check the rows against the schema bounds; returns a list of problems (empty when valid).
+    With required=True every schema column must be present. Meant for the values as received,
+    before coerce: integer columns must hold whole numbers in the range of their dtype, which a
+    cast would otherwise wrap or truncate (-5 -> 4294967291 for uint32).
+    """
+    problems = []
+    if required:
+        missing = [col for col in COLUMN_SCHEMA if col not in df.columns]
+        if missing:
+            problems.append(f"missing columns: {', '.join(missing)}")
+
+    duplicated = set(df.columns[df.columns.duplicated()])
+    if duplicated:
+        problems.append(f"duplicate columns: {', '.join(map(str, sorted(duplicated, key=str)))}")
+
+    for col in df.columns:
+        if col not in COLUMN_SCHEMA or col in duplicated:
+            continue
+        dtype, low, high = COLUMN_SCHEMA[col]
+        values = df[col]
+        if not pd.api.types.is_numeric_dtype(values.dtype):
+            numeric = pd.to_numeric(values, errors="coerce")
+            bad = numeric.isna() & values.notna()
+            if bad.any():
+                problems.append(f"{col}: {int(bad.sum())} non-numeric values")
+                continue
+            values = numeric
+        values = values.to_numpy()
+        if np.dtype(dtype).kind in "iu":
+            info = np.iinfo(dtype)
+            exact = values.astype(np.float64)
+            with np.errstate(invalid="ignore"):
+                bad = np.isnan(exact) | (exact != np.floor(exact)) | (exact < info.min) | (exact > info.max)
+            if bad.any():
+                problems.append(f"{col}: {int(bad.sum())} values that are not {dtype} integers")
+                continue
+        if low is not None and (values < low).any():
+            problems.append(f"{col}: {int((values < low).sum())} values below {low}")
+        if high is not None and (values > high).any():
+            problems.append(f"{col}: {int((values > high).sum())} values above {high}")
+    return problems
+
+
+def check(df: pd.DataFrame, required: bool = False) -> pd.DataFrame:
+    """
+    Validate the rows as received, then coerce them, raising SchemaError on any problem
+    """
+    conflicts = renamed_conflicts(df.columns)
+    if conflicts:
+        raise SchemaError("; ".join(conflicts))
+    df = rename(df)
+    problems = validate(df, required)
+    if problems:
+        raise SchemaError("; ".join(problems))
+    try:
+        return coerce(df)
+    except (TypeError, ValueError) as e:
+        raise SchemaError(str(e)) from e
@@ -0,0 +1,430 @@
+import argparse
+import csv
+import http.client
+import io
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+import warnings
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+
+import Schema
+from Metrics import METRICS
+from Storage import ArrowStore, SIDECAR_SUFFIX, coerce_invalid, csv_chunks, segment_span, sidecar_path
+
+# 📌 Sorgenti dei dati: CSV su GitHub e copia locale per la Demo Mode
+CSV_URL = "https://raw.githubusercontent.com/FabioDani2295/CoffeeController/main/CoffeStatistics.csv"
+LOCAL_CSV = "CoffeStatistics.csv"
+SQLITE_TABLE = "samples"
+HTTP_TIMEOUT = 10  # Secondi per connessione e lettura
+HTTP_IDLE_CONNECTIONS = 4  # Connessioni keep-alive tenute aperte per host
+READ_CHUNK_ROWS = 100_000  # Righe per blocco nella lettura a flusso dei job batch
+
+
+class Batch(NamedTuple):
+    """Rows returned by a source; reset=True means they replace the whole history"""
+    rows: pd.DataFrame
+    reset: bool = False
+
+
+def parse_csv(data: io.BytesIO, columns: List[str], origin, **kwargs) -> pd.DataFrame:
+    """
+    pd.read_csv straight into the schema dtypes. A token that does not parse (e.g. "ERR" from a
+    faulty sensor) fails the typed parse: the block is then read with inferred dtypes, the bad
+    cells are reported (Schema.validate) and read as NaN (Schema.coerce).
+    """
+    try:
+        # coerce only parses the timestamps here, so the sidecar keeps them as integer epochs
+        return Schema.coerce(pd.read_csv(data, names=columns, dtype=Schema.dtypes_for(columns), **kwargs))
+    except ValueError:
+        data.seek(0)
+        return coerce_invalid(pd.read_csv(data, names=columns, **kwargs), origin)
+
+
+class CsvFileSource:
+    """
+    Local CSV file (e.g. the spool written by the sensor rig), tail-read from the last byte offset.
+    With a sidecar ArrowStore the parsed rows are also kept in columnar form, so a restart maps
+    the store and only parses the CSV bytes written after it.
+    """
+
+    def __init__(self, path: str, sidecar: Optional[ArrowStore] = None):
+        self.path = path
+        self.sidecar = sidecar
+        self.columns = None
+        self.header = ""
+        self.offset = 0  # bytes of complete lines already parsed
+
+    def __repr__(self):
+        return f"CsvFileSource({self.path!r})"
+
+    def rows_since(self, last_id=None) -> Batch:
+        reset = False
+        size = os.path.getsize(self.path)
+        with open(self.path, 'rb') as f:
+            cached = self._resume(f, size) if self.columns is None and self.sidecar is not None else None
+            if self.offset:
+                # The file must still end the consumed part on a line break, otherwise it was rewritten
+                f.seek(self.offset - 1)
+                if size < self.offset or f.read(1) != b"\n":
+                    self.columns, self.offset, reset = None, 0, True
+                    self._clear_sidecar()
+                    f.seek(0)
+            chunk = f.read()
+
+        rows = self._parse(chunk)
+        if self.sidecar is not None:
+            try:
+                self.sidecar.append(rows, self.offset, self.header)
+            except OSError as e:
+                warnings.warn(f"Disabling the Arrow sidecar of {self.path}: {e}")
+                self.sidecar = None
+        if cached is not None:
+            rows = pd.concat([cached, rows], ignore_index=True) if not rows.empty else cached
+        return Batch(rows, reset)
+
+    def _resume(self, f, size: int) -> Optional[pd.DataFrame]:
+        # Riprende dallo store colonnare se corrisponde ancora all'inizio del CSV
+        try:
+            cached, metadata = self.sidecar.read_pandas()
+        except (OSError, pa.ArrowException):
+            cached, metadata = pd.DataFrame(), {}
+        offset = int(metadata.get("csv_offset", 0))
+        header = f.readline().decode().rstrip("\r\n")
+        valid = 0 < offset <= size and metadata.get("csv_header") == header
+        if valid:
+            f.seek(offset - 1)
+            valid = f.read(1) == b"\n"
+        f.seek(0)
+        if not valid:
+            self._clear_sidecar()
+            return None
+        self.columns, self.header, self.offset = list(cached.columns), header, offset
+        return cached
+
+    def _clear_sidecar(self):
+        if self.sidecar is not None:
+            self.sidecar.clear()
+
+    def _parse(self, chunk: bytes) -> pd.DataFrame:
+        # Parse only complete lines, a partially written row is picked up next time
+        end = chunk.rfind(b"\n") + 1
+        if self.columns is None and end == 0:
+            end = len(chunk)  # Header-only file without trailing newline
+        if end == 0:
+            return pd.DataFrame(columns=self.columns)
+        self.offset += end
+        data = io.BytesIO(chunk[:end])
+
+        if self.columns is None:
+            self.header = chunk[:end].split(b"\n", 1)[0].decode().rstrip("\r")
+            # Colonne rinominate e tipizzate già in lettura: nessuna copia né inferenza dopo il parse
+            self.columns = Schema.display_names(next(csv.reader([self.header])))
+            return parse_csv(data, self.columns, self, header=0)
+        return parse_csv(data, self.columns, self, header=None)
+
+
+class HttpStatusError(OSError):
+    """Unexpected HTTP status from a source server"""
+
+    def __init__(self, url: str, status: int, reason: str = ""):
+        super().__init__(f"HTTP {status} {reason} for {url}".replace("  ", " "))
+        self.status = status
+
+
+class HttpPool:
+    """
+    Keep-alive HTTP(S) connections shared by all HTTP sources, up to HTTP_IDLE_CONNECTIONS idle
+    ones per host, so a poll reuses the TCP/TLS connection instead of opening a new one.
+    Safe to use from the poll threads: a connection is held by one request at a time.
+    """
+
+    def __init__(self, max_idle: int = HTTP_IDLE_CONNECTIONS):
+        self.max_idle = max_idle
+        self.opened = 0
+        self.reused = 0
+        self._idle: Dict[Tuple[str, str], List[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+
+    def request(self, url: str, headers: Optional[Dict[str, str]] = None,
+                timeout: float = HTTP_TIMEOUT) -> Tuple[int, http.client.HTTPMessage, bytes]:
+        """
+        GET the url and return (status, headers, body)
+        """
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        while True:
+            conn, reused = self._acquire(key, timeout)
+            try:
+                with METRICS.span("http_request", host=parts.netloc):
+                    conn.request("GET", target, headers=headers or {})
+                    response = conn.getresponse()
+                    body = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if reused:
+                    continue  # The server closed the idle connection, retry once on a fresh one
+                raise
+            except Exception:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            METRICS.count("http_requests", host=parts.netloc, status=response.status)
+            METRICS.count("http_received_bytes", len(body), host=parts.netloc)
+            return response.status, response.headers, body
+
+    def _acquire(self, key: Tuple[str, str], timeout: float):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.reused += 1
+                conn = idle.pop()
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+            self.opened += 1
+        scheme, netloc = key
+        factory = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return factory(netloc, timeout=timeout), False
+
+    def _release(self, key: Tuple[str, str], conn: http.client.HTTPConnection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+HTTP_POOL = HttpPool()
+
+
+class HttpCsvSource(CsvFileSource):
+    """
+    CSV served over HTTP(S): GitHub raw files or a local stand-in server. Only the bytes appended
+    since the last request are transferred (Range), an unchanged file costs a 304
+    (If-None-Match / If-Modified-Since) and is not parsed. Connections come from HTTP_POOL.
+    """
+
+    def __init__(self, url: str, timeout: float = HTTP_TIMEOUT, cache_buster: bool = True,
+                 pool: Optional[HttpPool] = None):
+        super().__init__(url)
+        self.url = url
+        self.timeout = timeout
+        self.cache_buster = cache_buster
+        self.pool = pool or HTTP_POOL
+        self.etag = None
+        self.last_modified = None
+
+    def __repr__(self):
+        return f"HttpCsvSource({self.url!r})"
+
+    def rows_since(self, last_id=None) -> Batch:
+        chunk, reset = self._fetch()
+        return Batch(self._parse(chunk), reset)
+
+    def _fetch(self, reset: bool = False):
+        url = self.url
+        if self.cache_buster:
+            # Timestamp per evitare la cache della CDN di GitHub
+            url += ("&" if "?" in url else "?") + str(int(time.time()))
+        headers = {}
+        if self.offset:
+            # Start one byte early to check that the consumed part still ends on a line break
+            headers["Range"] = f"bytes={self.offset - 1}-"
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+            elif self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+
+        status, response_headers, body = self.pool.request(url, headers, self.timeout)
+        if status == 304:
+            return b"", reset
+        if status == 416:
+            # The file shrank: start over with a full download
+            self._restart()
+            return self._fetch(reset=True)
+        if status not in (200, 206):
+            raise HttpStatusError(self.url, status)
+
+        if status == 206:
+            if body[:1] != b"\n":
+                # The file was rewritten: rebuild the history from a full download
+                self._restart()
+                return self._fetch(reset=True)
+            body = body[1:]
+        elif self.offset:
+            # The server ignored the range and sent the full file
+            self._restart()
+            reset = True
+        self.etag = response_headers.get("ETag")
+        self.last_modified = response_headers.get("Last-Modified")
+        return body, reset
+
+    def _restart(self):
+        self.columns, self.offset, self.etag, self.last_modified = None, 0, None, None
+
+
+class ArrowSource:
+    """
+    Source reading an ArrowStore directly, for stores fed by the converter or by a CSV sidecar
+    """
+
+    def __init__(self, directory: str):
+        self.store = ArrowStore(directory)
+        self.store_id = None
+        self.last_segment = -1  # Ultimo numero di append già letto
+        self.rows_read = 0
+
+    def __repr__(self):
+        return f"ArrowSource({self.store.directory!r})"
+
+    def rows_since(self, last_id=None):
+        store_id, paths = self.store.listing()
+        # Position kept as the store row reached (rows_read), not as an id, so stores without an id
+        # column append too; only a rebuilt store (new identity) is read again from the start
+        reset = store_id != self.store_id
+        if reset:
+            self.last_segment, self.rows_read = -1, 0
+        # Only the listed segments: one written after the listing is read, once, by the next poll
+        unread = [path for path in paths if segment_span(path)[1] > self.last_segment]
+        table, metadata = self.store.read(segments=unread)
+        self.store_id = store_id
+        if table is None:
+            return Batch(pd.DataFrame(), reset)
+        # A merged segment can start with rows of segments already read
+        table = table.slice(max(self.rows_read - int(metadata.get("first_row", self.rows_read)), 0))
+        self.last_segment = segment_span(unread[-1])[1]
+        self.rows_read += table.num_rows
+        rows = table.to_pandas(split_blocks=True)
+        if reset and last_id is not None and 'id' in rows.columns and len(rows):
+            # After a rebuild keep reading as an append if the old rows are still there
+            if rows['id'].iloc[0] <= last_id <= rows['id'].iloc[-1]:
+                return Batch(rows[rows['id'] > last_id].reset_index(drop=True))
+        return Batch(rows, reset)
+
+
+class SQLiteSource:
+    """
+    SQLite store with one row per sample and an integer "id" column; new rows are read with an
+    indexed "id > N" query
+    """
+
+    def __init__(self, path: str, table: str = SQLITE_TABLE):
+        self.path = path
+        self.table = table
+
+    def __repr__(self):
+        return f"SQLiteSource({self.path!r}, table={self.table!r})"
+
+    def rows_since(self, last_id=None) -> Batch:
+        # A fresh connection per call, the data service polls from its own thread
+        with sqlite3.connect(self.path) as conn:
+            if last_id is None:
+                rows = pd.read_sql_query(f'SELECT * FROM "{self.table}" ORDER BY id', conn)
+                return Batch(rows, reset=True)
+
+            rows = pd.read_sql_query(f'SELECT * FROM "{self.table}" WHERE id > ? ORDER BY id', conn,
+                                     params=(int(last_id),))
+            if rows.empty:
+                # Ids going backwards mean the table was recreated
+                max_id = conn.execute(f'SELECT MAX(id) FROM "{self.table}"').fetchone()[0]
+                if max_id is None or max_id < last_id:
+                    rows = pd.read_sql_query(f'SELECT * FROM "{self.table}" ORDER BY id', conn)
+                    return Batch(rows, reset=True)
+            return Batch(rows)
+
+
+def open_source(spec: str):
+    """
+    Build a source from its spec: an http(s) URL, "sqlite:///path.db[?table=name]",
+    a .db/.sqlite path, an Arrow store directory (.arrow), or the path of a local CSV file.
+    Local CSV files get an Arrow sidecar next to them unless COFFEE_SIDECAR=0.
+    """
+    if spec.startswith(("http://", "https://")):
+        return HttpCsvSource(spec)
+    if spec.startswith("sqlite://"):
+        path, _, query = spec[len("sqlite://"):].partition("?")
+        table = dict(p.split("=", 1) for p in query.split("&") if "=" in p).get("table", SQLITE_TABLE)
+        return SQLiteSource(path[1:] if path.startswith("/") else path, table)
+    if spec.endswith((".db", ".sqlite", ".sqlite3")):
+        return SQLiteSource(spec)
+    if spec.rstrip("/").endswith(SIDECAR_SUFFIX):
+        return ArrowSource(spec)
+    if os.environ.get("COFFEE_SIDECAR", "1") == "0":
+        return CsvFileSource(spec)
+    return CsvFileSource(spec, sidecar=ArrowStore(sidecar_path(spec)))
+
+
+def read_chunks(spec: str, chunk_rows: int = READ_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    Stream a whole source as frames of at most chunk_rows rows, with display names and schema dtypes,
+    for batch jobs over histories larger than memory. Local CSV files and SQLite tables are read
+    chunk by chunk; remote CSV files and Arrow stores are read once and then split.
+    """
+    source = open_source(spec)
+    if isinstance(source, CsvFileSource) and not isinstance(source, HttpCsvSource):
+        with open(source.path, newline='') as f:
+            columns = Schema.display_names(next(csv.reader(f), []))
+        chunks = csv_chunks(source.path, columns, chunk_rows)
+    elif isinstance(source, SQLiteSource):
+        conn = sqlite3.connect(source.path)
+        try:
+            for chunk in pd.read_sql_query(f'SELECT * FROM "{source.table}" ORDER BY id', conn, chunksize=chunk_rows):
+                yield Schema.coerce(chunk)
+        finally:
+            conn.close()
+        return
+    else:
+        rows = source.rows_since().rows
+        chunks = (rows.iloc[start:start + chunk_rows] for start in range(0, len(rows), chunk_rows))
+    for chunk in chunks:
+        yield Schema.coerce(chunk)
+
+
+def configured_source(argv=None) -> str:
+    """
+    Source spec from the command line (streamlit run App.py -- --source SPEC),
+    then the COFFEE_SOURCE environment variable, then the GitHub CSV
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--source", default=os.environ.get("COFFEE_SOURCE", CSV_URL))
+    args, _ = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+    return args.source
+
+
+def configured_fleet(argv=None) -> Dict[str, str]:
+    """
+    Machine id -> source spec for fleet mode, from --fleet SPEC or COFFEE_FLEET. SPEC is either a
+    JSON file ({"machine": "source spec", ...}) or "machine=spec,machine=spec". Empty when not set.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--fleet", default=os.environ.get("COFFEE_FLEET", ""))
+    args, _ = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+    if not args.fleet:
+        return {}
+    if os.path.isfile(args.fleet):
+        with open(args.fleet) as f:
+            return {str(machine): spec for machine, spec in json.load(f).items()}
+    return dict(entry.strip().split("=", 1) for entry in args.fleet.split(",") if "=" in entry)
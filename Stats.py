@@ -0,0 +1,347 @@
+import copy
+from statistics import NormalDist
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from Analytics import covariance_to_correlation, percentile_rank
+
+
+class RunningStats:
+    """
+    Streaming count, mean, variance (Welford/Chan batch merge), min and max for every numeric
+    column. Each refresh feeds only the newly appended rows, so the cost is O(new rows).
+    """
+
+    def __init__(self):
+        self.columns: List[str] = []
+        self.count = np.zeros(0)
+        self._mean = np.zeros(0)
+        self._m2 = np.zeros(0)
+        self._min = np.zeros(0)
+        self._max = np.zeros(0)
+
+    def copy(self) -> "RunningStats":
+        return copy.deepcopy(self)
+
+    def update(self, df: pd.DataFrame):
+        """
+        Merge a batch of new rows into the running statistics
+        """
+        numeric = df.select_dtypes("number")
+        if numeric.empty:
+            return
+        self._add_columns(numeric.columns)
+        values = numeric.reindex(columns=self.columns).to_numpy(dtype=np.float64)
+
+        count_b = np.sum(~np.isnan(values), axis=0)
+        present = count_b > 0
+        if not present.any():
+            return
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_b = np.where(present, np.nansum(values, axis=0) / np.maximum(count_b, 1), 0.0)
+            m2_b = np.nansum((values - mean_b) ** 2, axis=0)
+            total = self.count + count_b
+            delta = mean_b - self._mean
+            weight = np.where(present, count_b / np.maximum(total, 1), 0.0)
+            self._mean = self._mean + delta * weight
+            self._m2 = self._m2 + m2_b + np.where(present, delta ** 2 * self.count * weight, 0.0)
+        # fmin/fmax ignore the NaN of columns without values in this batch
+        missing = np.isnan(values)
+        self._min = np.fmin(self._min, np.where(present, np.where(missing, np.inf, values).min(axis=0), np.nan))
+        self._max = np.fmax(self._max, np.where(present, np.where(missing, -np.inf, values).max(axis=0), np.nan))
+        self.count = total
+
+    def _add_columns(self, columns: Iterable[str]):
+        new = [col for col in columns if col not in self.columns]
+        if not new:
+            return
+        self.columns = self.columns + new
+        self.count = np.concatenate([self.count, np.zeros(len(new))])
+        self._mean = np.concatenate([self._mean, np.zeros(len(new))])
+        self._m2 = np.concatenate([self._m2, np.zeros(len(new))])
+        self._min = np.concatenate([self._min, np.full(len(new), np.nan)])
+        self._max = np.concatenate([self._max, np.full(len(new), np.nan)])
+
+    def _series(self, values: np.ndarray, columns: Optional[List[str]]) -> pd.Series:
+        series = pd.Series(np.where(self.count > 0, values, np.nan), index=self.columns)
+        return series if columns is None else series.reindex(columns)
+
+    def mean(self, columns: Optional[List[str]] = None) -> pd.Series:
+        return self._series(self._mean, columns)
+
+    def var(self, columns: Optional[List[str]] = None) -> pd.Series:
+        """
+        Sample variance (ddof=1), like pandas
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self._series(np.where(self.count > 1, self._m2 / (self.count - 1), np.nan), columns)
+
+    def std(self, columns: Optional[List[str]] = None) -> pd.Series:
+        return np.sqrt(self.var(columns))
+
+    def min(self, columns: Optional[List[str]] = None) -> pd.Series:
+        return self._series(self._min, columns)
+
+    def max(self, columns: Optional[List[str]] = None) -> pd.Series:
+        return self._series(self._max, columns)
+
+    def mean_without(self, latest: pd.Series) -> pd.Series:
+        """
+        Mean of every row except the latest one, e.g. for the "vs avg" deltas:
+        (n * mean - latest) / (n - 1)
+        """
+        columns = list(latest.index)
+        count = pd.Series(self.count, index=self.columns).reindex(columns)
+        total = self.mean(columns) * count
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return ((total - latest.astype(np.float64)) / (count - 1)).where(count > 1)
+
+
+class SortedIndex:
+    """
+    Sorted copy of every numeric column, merged with each batch of new rows, so percentile
+    ranks are a binary search. Arrays are replaced, never modified in place, which makes
+    copy() cheap and snapshots safe to share between sessions.
+    """
+
+    def __init__(self):
+        self.values: Dict[str, np.ndarray] = {}
+
+    def copy(self) -> "SortedIndex":
+        index = SortedIndex()
+        index.values = dict(self.values)
+        return index
+
+    def update(self, df: pd.DataFrame):
+        """
+        Merge a batch of new rows into the sorted arrays, O(n + k) per column instead of a full sort
+        """
+        for col in df.select_dtypes("number").columns:
+            batch = df[col].to_numpy()
+            batch = np.sort(batch[~np.isnan(batch)] if batch.dtype.kind == 'f' else batch)
+            current = self.values.get(col)
+            if current is None:
+                self.values[col] = batch
+            elif len(batch):
+                self.values[col] = np.insert(current, np.searchsorted(current, batch), batch)
+
+    def count(self, column: str) -> int:
+        return len(self.values.get(column, ()))
+
+    def percentile_rank(self, column: str, value) -> float:
+        """
+        Percentage of the samples strictly below value, in O(log n)
+        """
+        return percentile_rank(self.values.get(column, ()), value)
+
+    def percentile_ranks(self, latest: pd.Series) -> pd.Series:
+        return pd.Series({col: self.percentile_rank(col, value) for col, value in latest.items()}, dtype=np.float64)
+
+    def quantile(self, column: str, q: float) -> float:
+        values = self.values.get(column)
+        if values is None or not len(values):
+            return np.nan
+        return float(values[min(int(q * len(values)), len(values) - 1)])
+
+
+class RunningCovariance:
+    """
+    Running co-moment matrix over all numeric columns (Chan batch merge), so the correlation
+    matrix of any selection is read out in O(k^2) without touching the history. The columns are
+    fixed by the first batch; rows with missing values are left out.
+    """
+
+    def __init__(self):
+        self.columns: List[str] = []
+        self.count = 0
+        self._mean = np.zeros(0)
+        self._comoment = np.zeros((0, 0))
+
+    def copy(self) -> "RunningCovariance":
+        return copy.deepcopy(self)
+
+    def update(self, df: pd.DataFrame):
+        """
+        Merge a batch of new rows: C = C_a + C_b + delta delta^T * n_a * n_b / n
+        """
+        if not self.columns:
+            self.columns = list(df.select_dtypes("number").columns)
+            self._mean = np.zeros(len(self.columns))
+            self._comoment = np.zeros((len(self.columns), len(self.columns)))
+        if not self.columns or not set(self.columns).issubset(df.columns):
+            return
+        values = df[self.columns].to_numpy(dtype=np.float64)
+        values = values[~np.isnan(values).any(axis=1)]
+        count_b = len(values)
+        if not count_b:
+            return
+
+        mean_b = values.mean(axis=0)
+        centered = values - mean_b
+        delta = mean_b - self._mean
+        total = self.count + count_b
+        self._comoment += centered.T @ centered + np.outer(delta, delta) * self.count * count_b / total
+        self._mean += delta * count_b / total
+        self.count = total
+
+    def _positions(self, columns: List[str]) -> List[int]:
+        return [self.columns.index(col) for col in columns]
+
+    def covers(self, columns: Iterable[str]) -> bool:
+        return all(col in self.columns for col in columns)
+
+    def cov(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        columns = self.columns if columns is None else columns
+        positions = self._positions(columns)
+        matrix = self._comoment[np.ix_(positions, positions)] / (self.count - 1) if self.count > 1 \
+            else np.full((len(columns), len(columns)), np.nan)
+        return pd.DataFrame(matrix, index=columns, columns=columns)
+
+    def corr(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Pearson correlation of the selected columns, NaN where a column is constant (like pandas)
+        """
+        cov = self.cov(columns)
+        return pd.DataFrame(covariance_to_correlation(cov.to_numpy()), index=cov.index, columns=cov.columns)
+
+
+class TimeRollup:
+    """
+    Count, mean, variance, min and max per time bucket (hour, shift, day) of the local sample
+    time, so long-range views read one row per bucket instead of the raw samples. Each batch is
+    grouped in one vectorized pass and merged into the buckets with the same Chan formulas as
+    RunningStats. Arrays are replaced, never modified in place, which makes copy() cheap. The
+    columns are fixed by the first batch.
+    """
+
+    def __init__(self, freq: str, offset: str = "0h", tz: str = "UTC", column: str = "timestamp"):
+        self.freq = freq
+        self.offset = pd.Timedelta(offset)
+        self.tz = tz
+        self.column = column
+        self.columns: List[str] = []
+        self.keys = np.array([], dtype="datetime64[ns]")
+        self.count = np.zeros((0, 0))
+        self._mean = np.zeros((0, 0))
+        self._m2 = np.zeros((0, 0))
+        self._min = np.zeros((0, 0))
+        self._max = np.zeros((0, 0))
+
+    def copy(self) -> "TimeRollup":
+        return copy.copy(self)
+
+    def bucket_keys(self, timestamps: pd.Series) -> pd.Series:
+        """
+        Start of the bucket of each timestamp, as local wall-clock time (e.g. shifts from 06:00)
+        """
+        if timestamps.dt.tz is not None:
+            timestamps = timestamps.dt.tz_convert(self.tz).dt.tz_localize(None)
+        return (timestamps - self.offset).dt.floor(self.freq) + self.offset
+
+    def update(self, df: pd.DataFrame):
+        """
+        Merge a batch of new rows into the buckets of their timestamps; rows without one are skipped
+        """
+        if self.column not in df.columns or df.empty:
+            return
+        if not self.columns:
+            self.columns = list(df.select_dtypes("number").columns)
+            empty = np.zeros((0, len(self.columns)))
+            self.count, self._mean, self._m2, self._min, self._max = empty, empty, empty, empty, empty
+        if not self.columns or not set(self.columns).issubset(df.columns):
+            return
+        keys = self.bucket_keys(df[self.column]).to_numpy(dtype="datetime64[ns]")
+        valid = ~np.isnat(keys)
+        if not valid.any():
+            return
+        values = df[self.columns].to_numpy(dtype=np.float64)[valid]
+        batch_keys, codes = np.unique(keys[valid], return_inverse=True)
+
+        # Statistiche del batch per bucket, in un solo groupby vettoriale
+        grouped = pd.DataFrame(values).groupby(codes)
+        count_b = grouped.count().to_numpy(dtype=np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_b = np.where(count_b > 0, grouped.sum().to_numpy() / np.maximum(count_b, 1), 0.0)
+        m2_b = pd.DataFrame((values - mean_b[codes]) ** 2).groupby(codes).sum().to_numpy()
+        min_b = grouped.min().to_numpy()
+        max_b = grouped.max().to_numpy()
+
+        positions = np.searchsorted(self.keys, batch_keys)
+        existing = positions < len(self.keys)
+        existing[existing] = self.keys[positions[existing]] == batch_keys[existing]
+
+        count, mean, m2 = self.count.copy(), self._mean.copy(), self._m2.copy()
+        low, high = self._min.copy(), self._max.copy()
+        at = positions[existing]
+        if len(at):
+            count_a, n_b = count[at], count_b[existing]
+            total = count_a + n_b
+            delta = mean_b[existing] - mean[at]
+            weight = n_b / np.maximum(total, 1)
+            mean[at] = mean[at] + delta * weight
+            m2[at] = m2[at] + m2_b[existing] + delta ** 2 * count_a * weight
+            count[at] = total
+            low[at] = np.fmin(low[at], min_b[existing])
+            high[at] = np.fmax(high[at], max_b[existing])
+
+        new = ~existing
+        self.keys = np.insert(self.keys, positions[new], batch_keys[new])
+        self.count = np.insert(count, positions[new], count_b[new], axis=0)
+        self._mean = np.insert(mean, positions[new], mean_b[new], axis=0)
+        self._m2 = np.insert(m2, positions[new], m2_b[new], axis=0)
+        self._min = np.insert(low, positions[new], min_b[new], axis=0)
+        self._max = np.insert(high, positions[new], max_b[new], axis=0)
+
+    def frame(self, columns: List[str], stat: str = "mean") -> pd.DataFrame:
+        """
+        One row per bucket, in time order: the bucket start ("Time"), the sample count ("Samples")
+        and the requested statistic (mean, std, var, min, max, count) of each column
+        """
+        positions = [self.columns.index(col) for col in columns]
+        count = self.count[:, positions]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if stat == "count":
+                values = count
+            elif stat in ("var", "std"):
+                values = np.where(count > 1, self._m2[:, positions] / (count - 1), np.nan)
+                values = np.sqrt(values) if stat == "std" else values
+            else:
+                chosen = {"mean": self._mean, "min": self._min, "max": self._max}[stat]
+                values = np.where(count > 0, chosen[:, positions], np.nan)
+        frame = pd.DataFrame(values, columns=columns)
+        frame.insert(0, "Samples", self.count.max(axis=1, initial=0).astype(np.int64))
+        frame.insert(0, "Time", pd.DatetimeIndex(self.keys))
+        return frame
+
+
+def robust_zscores(values: np.ndarray, columns: List[str], ranks: SortedIndex, stats: RunningStats,
+                   min_scale: float = 0.0) -> np.ndarray:
+    """
+    Robust z-scores of an (n, k) array of samples: distance from the median of each column in units
+    of IQR / 1.349 (the standard deviation for normal data), both read from the sorted index in
+    O(1). Columns with a zero IQR fall back to the running standard deviation; the scale is never
+    below min_scale times the observed range of the column, so a nearly constant column cannot
+    produce huge scores. Constant columns give NaN. float32 input is scored in float32.
+    """
+    median = np.array([ranks.quantile(col, 0.5) for col in columns], dtype=np.float64)
+    iqr = np.array([ranks.quantile(col, 0.75) - ranks.quantile(col, 0.25) for col in columns], dtype=np.float64)
+    observed = (stats.max(columns) - stats.min(columns)).to_numpy(dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        scale = np.where(iqr > 0, iqr / 1.349, stats.std(columns).to_numpy())
+        scale = np.fmax(scale, min_scale * observed)
+        scale = np.where(scale > 0, scale, np.nan)
+    values = np.asarray(values)
+    dtype = values.dtype if values.dtype.kind == 'f' else np.float64
+    return (values.astype(dtype, copy=False) - median.astype(dtype)) * (1 / scale).astype(dtype)
+
+
+def family_threshold(threshold: float, columns: int) -> float:
+    """
+    Threshold for the largest of `columns` independent |z| scores with the same false alarm rate
+    as `threshold` for a single one (Bonferroni on the two-sided normal tail)
+    """
+    normal = NormalDist()
+    tail = 2 * (1 - normal.cdf(threshold))
+    return normal.inv_cdf(1 - tail / (2 * max(columns, 1)))
@@ -0,0 +1,246 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import time
+import uuid
+import warnings
+from typing import Iterator, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+
+import Schema
+
+SIDECAR_SUFFIX = ".arrow"
+MANIFEST = "manifest.json"
+COMPACT_FANOUT = 8  # Segmenti consecutivi della stessa taglia in coda che vengono uniti in uno
+OBSOLETE_GRACE = 60.0  # Secondi prima di cancellare i segmenti sostituiti (lettori ancora sulla lista vecchia)
+
+
+def segment_span(path: str) -> Tuple[int, int]:
+    """
+    First and last append number covered by a segment: seg-000007.arrow is (7, 7), a merged
+    seg-000000-000007.arrow is (0, 7)
+    """
+    numbers = os.path.basename(path)[4:-6].split("-")
+    return int(numbers[0]), int(numbers[-1])
+
+
+class ArrowStore:
+    """
+    Columnar copy of the sample history: a directory of Arrow IPC segment files that are
+    memory-mapped on read, listed in order by a manifest that is replaced atomically. New rows
+    are written as a new segment, so appending costs O(new rows); once the tail holds
+    COMPACT_FANOUT segments of the same size they are merged into one (tiered merging), so each
+    row is rewritten O(log rows) times and the head of the store is never touched again.
+    Segments replaced by a merge stay on disk for OBSOLETE_GRACE seconds, so a reader still on
+    the previous list can open them. Each segment records the byte offset reached in the CSV it
+    was ingested from and the store row it starts at.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def __repr__(self):
+        return f"ArrowStore({self.directory!r})"
+
+    def listing(self) -> Tuple[str, List[str]]:
+        """
+        Identity of the store (it changes when the store is cleared and rebuilt) and its segments in order
+        """
+        manifest = self._manifest()
+        if manifest is None:
+            # Store scritto prima del manifest: l'ordine dei nomi è quello di scrittura
+            return "", sorted(glob.glob(os.path.join(self.directory, "seg-*.arrow")))
+        return manifest["store"], [os.path.join(self.directory, name) for name in manifest["segments"]]
+
+    def segments(self) -> List[str]:
+        return self.listing()[1]
+
+    def exists(self) -> bool:
+        return bool(self.segments())
+
+    def append(self, df: pd.DataFrame, csv_offset: int = 0, csv_header: str = ""):
+        """
+        Write the rows as a new segment, then merge the tail if it is full
+        """
+        if df.empty:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = self._load()
+        segments = manifest["segments"]
+        number = segment_span(segments[-1])[1] + 1 if segments else 0
+        name = f"seg-{number:06d}.arrow"
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        self._write(table, os.path.join(self.directory, name), csv_offset, csv_header, manifest["rows"])
+        segments.append(name)
+        manifest["rows"] += table.num_rows
+        while len(segments) >= COMPACT_FANOUT and len({self._covered(n) for n in segments[-COMPACT_FANOUT:]}) == 1:
+            self._merge(manifest, COMPACT_FANOUT)
+        self._save(manifest)
+
+    def read(self, skip: int = 0, segments: Optional[List[str]] = None) -> Tuple[Optional[pa.Table], dict]:
+        """
+        Memory-map the segments after the first `skip` ones; returns the table and the metadata
+        of the last segment (csv_offset, csv_header), with first_row the store row the table starts
+        at. Pass the list from segments() to read exactly those files, without picking up a segment
+        written in the meantime.
+        """
+        segments = self.segments() if segments is None else segments
+        tables = [self._map(path) for path in segments[skip:]]
+        if not tables:
+            return None, {}
+        metadata = {k.decode(): v.decode() for k, v in (tables[-1].schema.metadata or {}).items()}
+        first = (tables[0].schema.metadata or {}).get(b"first_row")
+        metadata.pop("first_row", None)
+        if first is not None:
+            metadata["first_row"] = first.decode()
+        tables = [t.replace_schema_metadata(None) for t in tables]
+        return pa.concat_tables(tables, promote_options="permissive"), metadata
+
+    def read_pandas(self) -> Tuple[pd.DataFrame, dict]:
+        table, metadata = self.read()
+        if table is None:
+            return pd.DataFrame(), metadata
+        # Non zero-copy per il loader, che copia ogni colonna nei suoi buffer di storia: split_blocks
+        # evita solo una seconda copia, il consolidamento delle colonne in un blocco per dtype
+        return table.to_pandas(split_blocks=True), metadata
+
+    def compact(self):
+        """
+        Merge all segments into one (e.g. after a bulk conversion)
+        """
+        manifest = self._load()
+        if len(manifest["segments"]) < 2:
+            return
+        self._merge(manifest, len(manifest["segments"]))
+        self._save(manifest)
+
+    def clear(self):
+        manifest = self._manifest() or {"obsolete": []}
+        for path in set(self.segments()) | {os.path.join(self.directory, name) for name, _ in manifest["obsolete"]}:
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(os.path.join(self.directory, MANIFEST)):
+            os.remove(os.path.join(self.directory, MANIFEST))
+
+    @staticmethod
+    def _covered(name: str) -> int:
+        first, last = segment_span(name)
+        return last - first + 1
+
+    def _merge(self, manifest: dict, count: int):
+        # Unisce gli ultimi `count` segmenti; i file vecchi restano finché i lettori non hanno la lista nuova
+        tail = manifest["segments"][-count:]
+        table, metadata = self.read(segments=[os.path.join(self.directory, name) for name in tail])
+        name = f"seg-{segment_span(tail[0])[0]:06d}-{segment_span(tail[-1])[1]:06d}.arrow"
+        self._write(table.combine_chunks(), os.path.join(self.directory, name), int(metadata.get("csv_offset", 0)),
+                    metadata.get("csv_header", ""), manifest["rows"] - table.num_rows)
+        manifest["segments"][-count:] = [name]
+        manifest["obsolete"] += [[old, time.time()] for old in tail]
+
+    def _manifest(self) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.directory, MANIFEST)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _load(self) -> dict:
+        manifest = self._manifest()
+        if manifest is None:
+            segments = self.segments()
+            manifest = {"store": uuid.uuid4().hex, "segments": [os.path.basename(path) for path in segments],
+                        "rows": sum(self._map(path).num_rows for path in segments), "obsolete": []}
+        return manifest
+
+    def _save(self, manifest: dict):
+        now = time.time()
+        for name, replaced in manifest["obsolete"]:
+            if now - replaced > OBSOLETE_GRACE and os.path.exists(os.path.join(self.directory, name)):
+                os.remove(os.path.join(self.directory, name))
+        manifest["obsolete"] = [[name, replaced] for name, replaced in manifest["obsolete"]
+                                if now - replaced <= OBSOLETE_GRACE]
+        path = os.path.join(self.directory, MANIFEST)
+        with open(path + ".tmp", 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def _map(path: str) -> pa.Table:
+        with pa.memory_map(path, 'r') as source:
+            return pa.ipc.open_file(source).read_all()
+
+    @staticmethod
+    def _write(table: pa.Table, path: str, csv_offset: int, csv_header: str, first_row: int = 0):
+        table = table.replace_schema_metadata({"csv_offset": str(csv_offset), "csv_header": csv_header,
+                                               "first_row": str(first_row)})
+        # Scrittura su file temporaneo + rename, un lettore non vede mai un segmento a metà
+        tmp_path = path + ".tmp"
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+
+
+def sidecar_path(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + SIDECAR_SUFFIX
+
+
+def coerce_invalid(rows: pd.DataFrame, origin) -> pd.DataFrame:
+    """
+    Cast rows read with inferred dtypes to the schema, warning about the cells that become NaN
+    """
+    problems = Schema.validate(rows)
+    if problems:
+        warnings.warn(f"{origin!r}: " + "; ".join(problems))
+    return Schema.coerce(rows)
+
+
+def csv_chunks(path: str, columns: List[str], chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """
+    Chunks of a CSV file parsed straight into the schema dtypes; from a chunk holding a token that
+    does not parse (e.g. "ERR" from a faulty sensor) on, chunks are read with inferred dtypes and
+    cast with coerce_invalid, so bad cells become NaN instead of failing the whole file
+    """
+    done = 0
+    try:
+        for chunk in pd.read_csv(path, header=0, names=columns, dtype=Schema.dtypes_for(columns),
+                                 chunksize=chunk_rows):
+            done += len(chunk)
+            yield Schema.coerce(chunk)  # Timestamps parsed once, stored as integer epochs
+        return
+    except ValueError:
+        pass
+    for chunk in pd.read_csv(path, header=0, names=columns, skiprows=range(1, done + 1), chunksize=chunk_rows):
+        yield coerce_invalid(chunk, path)
+
+
+def convert_csv(csv_path: str, directory: Optional[str] = None, chunksize: int = 100_000) -> ArrowStore:
+    """
+    One-shot conversion of an existing CSV history into an ArrowStore, read in chunks
+    """
+    store = ArrowStore(directory or sidecar_path(csv_path))
+    store.clear()
+    with open(csv_path, 'rb') as f:
+        header = f.readline().decode().rstrip("\r\n")
+        size = f.seek(0, os.SEEK_END)
+    # Stessi nomi e dtype di CsvFileSource._parse, così lo store coincide con quanto letto dal CSV
+    columns = Schema.display_names(next(csv.reader([header])))
+    for chunk in csv_chunks(csv_path, columns, chunksize):
+        store.append(chunk, csv_offset=size, csv_header=header)
+    store.compact()
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a CoffeStatistics CSV into an Arrow sidecar store")
+    parser.add_argument("csv", help="CSV file to convert")
+    parser.add_argument("-o", "--output", help="Store directory (default: <csv name>.arrow)")
+    args = parser.parse_args()
+
+    store = convert_csv(args.csv, args.output)
+    table, _ = store.read()
+    print(f"Wrote {table.num_rows} rows to {store.directory}")
@@ -8,6 +8,8 @@ import io
 import base64
 from typing import List, Dict, Any
 
+from Analytics import color_summary, pm_summary, temperature_summary
+
 
 # Data processing functions
 def preprocess_data(df: pd.DataFrame) -> pd.DataFrame:
@@ -17,16 +19,9 @@ def preprocess_data(df: pd.DataFrame) -> pd.DataFrame:
     # Create a copy to avoid modifying the original
     processed_df = df.copy()
 
-    # Handle missing values if any
-    processed_df = processed_df.fillna(0)
-
-    # Add timestamp if it doesn't exist (for demo purposes)
-    if 'timestamp' not in processed_df.columns:
-        processed_df['timestamp'] = pd.date_range(
-            start=pd.Timestamp.now() - pd.Timedelta(days=len(processed_df) - 1),
-            periods=len(processed_df),
-            freq='D'
-        )
+    # Handle missing values if any (timestamps stay missing rather than invented)
+    numeric = processed_df.select_dtypes("number").columns
+    processed_df[numeric] = processed_df[numeric].fillna(0)
 
     return processed_df
 
@@ -35,51 +30,21 @@ def get_temperature_summary(df: pd.DataFrame) -> Dict[str, Any]:
     """
     Calculate temperature statistics
     """
-    temp_cols = [col for col in df.columns if 'Temperature' in col]
-    if not temp_cols:
-        return {}
-
-    summary = {
-        'max_temperature': df['Max Temperature (°C)'].max(),
-        'min_temperature': df['Min Temperature (°C)'].min(),
-        'avg_temperature': df['Mean Temperature (°C)'].mean(),
-        'temperature_range': df['Max Temperature (°C)'].max() - df['Min Temperature (°C)'].min(),
-        'above_40_percent': df['% Pixels Above 40°C'].mean()
-    }
-
-    return summary
+    return temperature_summary(df)
 
 
 def get_pm_summary(df: pd.DataFrame) -> Dict[str, Any]:
     """
     Calculate particulate matter statistics
     """
-    pm_cols = [col for col in df.columns if col.startswith('PM')]
-    if not pm_cols:
-        return {}
-
-    summary = {col: df[col].mean() for col in pm_cols}
-    summary['max_pm'] = max([df[col].max() for col in pm_cols])
-
-    return summary
+    return pm_summary(df)
 
 
 def get_color_summary(df: pd.DataFrame) -> Dict[str, Any]:
     """
     Calculate color statistics
     """
-    color_cols = ['Mean_Red', 'Mean_Green', 'Mean_Blue']
-    if not all(col in df.columns for col in color_cols):
-        return {}
-
-    summary = {
-        'avg_red': df['Mean_Red'].mean(),
-        'avg_green': df['Mean_Green'].mean(),
-        'avg_blue': df['Mean_Blue'].mean(),
-        'color_variance': np.var([df['Mean_Red'].mean(), df['Mean_Green'].mean(), df['Mean_Blue'].mean()])
-    }
-
-    return summary
+    return color_summary(df)
 
 
 # Visualization functions
@@ -119,37 +84,32 @@ def create_multi_y_axis_chart(df: pd.DataFrame, primary_cols: List[str], seconda
     return fig
 
 
-def create_color_visualization(df: pd.DataFrame):
+def color_array(df: pd.DataFrame) -> np.ndarray:
     """
-    Create a color visualization from RGB values
+    RGB of every sample as an (n, 3) uint8 array, read in one pass
     """
-    if not all(col in df.columns for col in ['Mean_Red', 'Mean_Green', 'Mean_Blue']):
-        return None
+    rgb = df[['Mean_Red', 'Mean_Green', 'Mean_Blue']].to_numpy(dtype=np.float64)
+    return np.clip(np.nan_to_num(rgb), 0, 255).astype(np.uint8)
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _encode_color_strip(rgb: np.ndarray, width: int, height: int) -> str:
+    # One pixel column per sample, resampled to the strip width
+    columns = np.arange(width) * len(rgb) // width
+    image = np.broadcast_to(rgb[columns][np.newaxis, :, :], (height, width, 3))
 
-    # Create the color swatches
-    fig, ax = plt.subplots(1, len(df), figsize=(len(df) * 0.5, 1))
-
-    # If there's only one datapoint, we need to handle differently
-    if len(df) == 1:
-        r, g, b = df['Mean_Red'].iloc[0] / 255, df['Mean_Green'].iloc[0] / 255, df['Mean_Blue'].iloc[0] / 255
-        ax.add_patch(plt.Rectangle((0, 0), 1, 1, color=(r, g, b)))
-        ax.set_xticks([])
-        ax.set_yticks([])
-        ax.set_frame_on(False)
-    else:
-        for i in range(len(df)):
-            r, g, b = df['Mean_Red'].iloc[i] / 255, df['Mean_Green'].iloc[i] / 255, df['Mean_Blue'].iloc[i] / 255
-            ax[i].add_patch(plt.Rectangle((0, 0), 1, 1, color=(r, g, b)))
-            ax[i].set_xticks([])
-            ax[i].set_yticks([])
-            ax[i].set_frame_on(False)
-
-    # Convert the figure to a base64 image
     buf = io.BytesIO()
-    fig.tight_layout()
-    fig.savefig(buf, format='png', bbox_inches='tight')
-    buf.seek(0)
-    img_str = base64.b64encode(buf.read()).decode()
-    plt.close(fig)
+    plt.imsave(buf, np.ascontiguousarray(image), format='png')
+    img_str = base64.b64encode(buf.getvalue()).decode()
+    return f'data:image/png;base64,{img_str}'
+
+
+def create_color_visualization(df: pd.DataFrame, width: int = 600, height: int = 20):
+    """
+    Create a color visualization from RGB values: a single strip image built directly from the
+    RGB array (cached on its content), one band per sample
+    """
+    if not all(col in df.columns for col in ['Mean_Red', 'Mean_Green', 'Mean_Blue']) or df.empty:
+        return None
 
-    return f'data:image/png;base64,{img_str}'
\ No newline at end of file
+    return _encode_color_strip(color_array(df), width, height)